@@ -3,6 +3,18 @@ Streamz Accumulators for use with processed hubtraf data
 """
 
 
+def is_failure(phase):
+    """
+    Return True if phase is that of a failed action.
+
+    Using startswith because some events use 'failure' vs 'failed'
+
+    >>> is_failure('failed'), is_failure('failure'), is_failure('complete')
+    (True, True, False)
+    """
+    return phase.startswith('fail')
+
+
 def count_in_progress(state, event):
     """
     Count in-progress actions.
@@ -17,8 +29,7 @@ def count_in_progress(state, event):
         state[action] = state.get(action, 0) + 1
     elif phase == 'complete':
         state[action] = state[action] - 1
-    elif phase.startswith('fail'):
-        # Using startswith because some events use 'failure' vs 'failed'
+    elif is_failure(phase):
         state[action] = state[action] - 1
         state[f'{action}.failed'] = state.get(f'{action}.failed', 0) + 1
     state['timestamp'] = event['timestamp']
@@ -2,20 +2,27 @@
 Dataframe related analysis helpers
 """
 
+import glob
 import io
 import json
+import os
 
 import pandas as pd
 import streamz
 
+from hubtraf.analysis.accumulators import is_failure
+from hubtraf.parser.compression import open_log
+
 
 def accumulate_to_df(logfile, accumulate_func):
     """
     Run an accumulator against a logfile, and return output in a dataframe
+
+    logfile may be gzip or zstd compressed.
     """
     stream = streamz.Stream()
 
-    with open(logfile) as infile, io.StringIO() as outfile:
+    with open_log(logfile) as infile, io.StringIO() as outfile:
         stream.map(json.loads).accumulate(
             accumulate_func, returns_state=True, start={}
         ).sink(lambda e: outfile.write(json.dumps(e) + '\n'))
@@ -27,12 +34,107 @@ def accumulate_to_df(logfile, accumulate_func):
     return dataframe
 
 
-def logfile_to_df(logfile):
+def logfile_to_df(logfile, chunksize=None):
     """
     Load a logfile into a dataframe
 
-    Will set timestamp as index
+    logfile may be gzip or zstd compressed. If chunksize is set, it is parsed
+    chunksize lines at a time, so the whole text of the log is never held in
+    memory. Will set timestamp as index
+    """
+    with open_log(logfile) as f:
+        if chunksize is None:
+            df = pd.read_json(f, lines=True)
+        else:
+            with pd.read_json(f, lines=True, chunksize=chunksize) as reader:
+                df = pd.concat(reader, ignore_index=True)
+    df.set_index('timestamp', inplace=True)
+    return df
+
+
+def collected_to_df(path):
     """
-    df = pd.read_json(logfile, lines=True)
+    Load events written by hubtraf-collector into a dataframe
+
+    path can be the collector's output directory or any partition in it.
+    Will set timestamp as index, sorted.
+    """
+    files = sorted(glob.glob(os.path.join(path, '**', '*.parquet'), recursive=True))
+    if not files:
+        # Nothing collected yet
+        df = pd.DataFrame({'timestamp': pd.to_datetime([], utc=True)})
+    else:
+        # Files can have different columns, so they aren't read as one dataset
+        df = pd.concat([pd.read_parquet(f) for f in files], ignore_index=True)
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
     df.set_index('timestamp', inplace=True)
+    df.sort_index(inplace=True, kind='stable')
     return df
+
+
+# Stages of a user's session, in the order they happen
+LIFECYCLE = [
+    'login',
+    'server-start',
+    'kernel-start',
+    'code-execute',
+    'kernel-stop',
+    'server-stop',
+]
+
+
+def session_table(df):
+    """
+    Return a dataframe with one row per user, summarizing their session
+
+    df is a dataframe of events, as returned by logfile_to_df or
+    collected_to_df. For each action, there are columns with the time of its
+    first start, complete & failed events - named like 'login.start' - and
+    the duration of its first completion, 'login.duration'. Actions users
+    never reached are NaT / NaN. For example:
+
+        table = session_table(logfile_to_df('events.log'))
+        # Seconds from login to first successful execute, per user
+        (table['code-execute.complete'] - table['login.start']).dt.total_seconds()
+        # Fraction of users who ever reached kernel-start
+        table['kernel-start.start'].notna().mean()
+    """
+    events = df.reset_index()
+    events = events[events['username'].notna() & events['action'].notna()]
+    phase = events['phase'].fillna('').astype(str)
+    stage = phase.where(phase.isin(['start', 'complete']))
+    stage = stage.mask(phase.map(is_failure), 'failed')
+    events = events.assign(stage=stage).dropna(subset=['stage'])
+
+    grouped = events.groupby(['username', 'action', 'stage'], sort=False)
+    times = grouped['timestamp'].min().unstack(['action', 'stage'])
+    times.columns = [f'{action}.{stage}' for action, stage in times.columns]
+
+    completions = events[events['stage'] == 'complete']
+    if 'duration' in completions:
+        # Duration reported with the first completion of each action
+        first = completions.sort_values('timestamp', kind='stable').drop_duplicates(
+            ['username', 'action']
+        )
+        durations = first.pivot(index='username', columns='action', values='duration')
+    else:
+        durations = pd.DataFrame(index=times.index)
+
+    actions = events['action'].unique()
+    ordered = [a for a in LIFECYCLE if a in actions] + sorted(
+        a for a in actions if a not in LIFECYCLE
+    )
+    columns = {}
+    for action in ordered:
+        for stage in ('start', 'complete', 'failed'):
+            name = f'{action}.{stage}'
+            columns[name] = times[name] if name in times else pd.NaT
+        duration = durations[action] if action in durations else None
+        if f'{action}.start' in times and f'{action}.complete' in times:
+            # Fall back to the time between first start & completion
+            elapsed = (
+                times[f'{action}.complete'] - times[f'{action}.start']
+            ).dt.total_seconds()
+            duration = elapsed if duration is None else duration.fillna(elapsed)
+        columns[f'{action}.duration'] = float('nan') if duration is None else duration
+    return pd.DataFrame(columns, index=times.index)
@@ -1,39 +1,45 @@
+import argparse
 import time
 import uuid
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 from oauthlib.oauth1.rfc5849 import signature
 
-from hubtraf.user import OperationError
 
-
-async def lti_login_data(
-    session,
-    log,
-    hub_url,
+def sign_launch(
     username,
     consumer_key,
     consumer_secret,
     launch_url,
+    timestamp=None,
     extra_args=None,
 ):
     """
-    Log in username with LTI info to hub_url
+    Return signed LTI 1.1 launch parameters for username.
 
-    log is used to emit timing and status information.
+    timestamp defaults to now. Launches signed ahead of time should pass the
+    time they will be sent at, so the hub doesn't reject them as too old.
     """
-    start_time = time.monotonic()
+    if timestamp is None:
+        timestamp = time.time()
     args = {
         'oauth_consumer_key': consumer_key,
-        'oauth_timestamp': str(time.time()),
-        'oauth_nonce': str(uuid.uuid4()),
+        'oauth_signature_method': 'HMAC-SHA1',
+        'oauth_timestamp': str(int(timestamp)),
+        'oauth_nonce': uuid.uuid4().hex,
+        'oauth_version': '1.0',
+        'lti_message_type': 'basic-lti-launch-request',
+        'lti_version': 'LTI-1p0',
+        'resource_link_id': 'hubtraf',
         'user_id': username,
     }
     if extra_args:
         args.update(extra_args)
 
-    base_string = signature.construct_base_string(
+    base_string = signature.signature_base_string(
         'POST',
-        signature.normalize_base_string_uri(launch_url),
+        signature.base_string_uri(str(launch_url)),
         signature.normalize_parameters(
             signature.collect_parameters(body=args, headers={})
         ),
@@ -42,11 +48,80 @@ async def lti_login_data(
     args['oauth_signature'] = signature.sign_hmac_sha1(
         base_string, consumer_secret, None
     )
+    return args
+
+
+def _sign_launch_at(launch, **kwargs):
+    # Helper for executor.map, which can only pass one argument
+    username, timestamp = launch
+    return sign_launch(username, timestamp=timestamp, **kwargs)
+
+
+def sign_launch_batch(
+    launches,
+    consumer_key,
+    consumer_secret,
+    launch_url,
+    extra_args=None,
+):
+    """
+    Return signed launch parameters for each (username, timestamp) in launches.
+
+    For submitting to a worker process, one batch of launches at a time.
+    """
+    return [
+        sign_launch(
+            username,
+            consumer_key,
+            consumer_secret,
+            launch_url,
+            timestamp=timestamp,
+            extra_args=extra_args,
+        )
+        for username, timestamp in launches
+    ]
+
+
+def sign_launches(
+    launches,
+    consumer_key,
+    consumer_secret,
+    launch_url,
+    extra_args=None,
+    workers=None,
+):
+    """
+    Sign many LTI launches in a pool of worker processes.
+
+    launches is a list of (username, timestamp) tuples. Returns a list of
+    signed launch parameters, in the same order.
+
+    Signing is done in separate processes so that signing thousands of
+    launches doesn't compete with the event loop sending them.
+    """
+    sign = partial(
+        _sign_launch_at,
+        consumer_key=consumer_key,
+        consumer_secret=consumer_secret,
+        launch_url=str(launch_url),
+        extra_args=extra_args,
+    )
+    with ProcessPoolExecutor(workers) as executor:
+        return list(executor.map(sign, launches, chunksize=256))
+
+
+async def login_lti(session, hub_url, log, username, launch_args):
+    """
+    Log in username to hub_url by posting already signed LTI launch_args.
+
+    log is used to emit timing and status information.
+    """
+    start_time = time.monotonic()
 
-    url = hub_url / 'lti/launch'
+    url = hub_url / 'hub/lti/launch'
 
     try:
-        resp = await session.post(url, data=args, allow_redirects=False)
+        resp = await session.post(url, data=launch_args, allow_redirects=False)
     except Exception as e:
         log.msg(
             f'Login: Failed with exception {repr(e)}',
@@ -54,7 +129,7 @@ async def lti_login_data(
             phase='failed',
             duration=time.monotonic() - start_time,
         )
-        raise OperationError()
+        return False
     if resp.status != 302:
         log.msg(
             f'Login: Failed with response {str(resp)}',
@@ -62,5 +137,75 @@ async def lti_login_data(
             phase='failed',
             duration=time.monotonic() - start_time,
         )
-        raise OperationError()
-    return args
+        return False
+    return True
+
+
+async def lti_login_data(
+    session,
+    log,
+    hub_url,
+    username,
+    consumer_key,
+    consumer_secret,
+    launch_url=None,
+    extra_args=None,
+):
+    """
+    Log in username with LTI info to hub_url, signing the launch on the spot
+
+    log is used to emit timing and status information.
+    """
+    if launch_url is None:
+        launch_url = hub_url / 'hub/lti/launch'
+    launch_args = sign_launch(
+        username, consumer_key, consumer_secret, launch_url, extra_args=extra_args
+    )
+    return await login_lti(session, hub_url, log, username, launch_args)
+
+
+def benchmark_signing(count, workers=None):
+    """
+    Return launches signed per second, in process and in a worker pool
+    """
+    launch_url = 'http://localhost/hub/lti/launch'
+    now = time.time()
+
+    start_time = time.perf_counter()
+    for i in range(count):
+        sign_launch(f'user-{i}', 'key', 'secret', launch_url, timestamp=now)
+    in_process = count / (time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    sign_launches(
+        [(f'user-{i}', now) for i in range(count)],
+        'key',
+        'secret',
+        launch_url,
+        workers=workers,
+    )
+    pool = count / (time.perf_counter() - start_time)
+
+    return in_process, pool
+
+
+def main():
+    """
+    Benchmark LTI launch signing throughput
+    """
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument(
+        'count', type=int, nargs='?', default=10000, help='Launches to sign'
+    )
+    argparser.add_argument(
+        '--workers', type=int, help='Worker processes, defaults to CPU count'
+    )
+    args = argparser.parse_args()
+
+    in_process, pool = benchmark_signing(args.count, args.workers)
+    print(f'In process: {in_process:.0f} launches/s')
+    print(f'Worker pool: {pool:.0f} launches/s')
+
+
+if __name__ == '__main__':
+    main()
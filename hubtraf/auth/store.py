@@ -0,0 +1,41 @@
+import os
+import time
+
+
+def cookies_path(store_dir, username):
+    return os.path.join(store_dir, f'{username}.cookies')
+
+
+def token_path(store_dir, username):
+    return os.path.join(store_dir, f'{username}.token')
+
+
+async def login_from_store(session, hub_url, log, username, store_dir):
+    """
+    Log in username by loading credentials saved by hubtraf-provision.
+
+    No requests are made to the hub. The cookie jar saved for username is
+    loaded into session if present, and a saved API token is sent as an
+    Authorization header with every request.
+
+    log is used to emit timing and status information.
+    """
+    start_time = time.monotonic()
+    found = False
+    if os.path.exists(cookies_path(store_dir, username)):
+        session.cookie_jar.load(cookies_path(store_dir, username))
+        found = True
+    if os.path.exists(token_path(store_dir, username)):
+        with open(token_path(store_dir, username)) as f:
+            session.headers['Authorization'] = f'token {f.read().strip()}'
+        found = True
+
+    if not found:
+        log.msg(
+            f'Login: No stored credentials found in {store_dir}',
+            action='login',
+            phase='failed',
+            duration=time.monotonic() - start_time,
+        )
+        return False
+    return True
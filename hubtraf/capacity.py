@@ -0,0 +1,279 @@
+"""
+Find the max number of users a hub can sustain while meeting its SLOs.
+
+Load is raised step by step (or by bisection) in one long-lived process.
+The same users - with their sessions, cookies and connection pool - are
+reused from one step to the next, so later steps don't pay for logging in
+or opening connections again.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import random
+import socket
+import time
+from collections import Counter
+from functools import partial
+
+import aiohttp
+
+from hubtraf.auth.dummy import login_dummy
+from hubtraf.cli import (
+    add_execute_arguments,
+    add_monitor_arguments,
+    add_teardown_arguments,
+    check_execute_arguments,
+    configure_structlog,
+    get_execute_mode,
+)
+from hubtraf.monitor import SaturationMonitor
+from hubtraf.shutdown import ShutdownManager, has_server
+from hubtraf.simulate import user_session
+from hubtraf.stats import Stats, percentile
+from hubtraf.user import User
+
+
+def check_slos(
+    stats,
+    outcomes,
+    server_start_p95=None,
+    code_execute_p99=None,
+    max_failure_rate=None,
+):
+    """
+    Return list of SLOs violated by a step, as human readable strings.
+
+    stats is the Stats of the step, outcomes a Counter of user_session results.
+    SLOs that are None aren't checked.
+    """
+    violations = []
+    if server_start_p95 is not None:
+        p95 = percentile(sorted(stats.durations['server-start']), 95)
+        if p95 is None or p95 > server_start_p95:
+            violations.append(f'server-start p95 {p95} > {server_start_p95}')
+    if code_execute_p99 is not None:
+        p99 = percentile(sorted(stats.durations['code-execute-iteration']), 99)
+        if p99 is None or p99 > code_execute_p99:
+            violations.append(f'code-execute p99 {p99} > {code_execute_p99}')
+    if max_failure_rate is not None:
+        total = sum(outcomes.values())
+        failure_rate = (total - outcomes['completed']) / total if total else 0
+        if failure_rate > max_failure_rate:
+            violations.append(f'failure rate {failure_rate:.3f} > {max_failure_rate}')
+    return violations
+
+
+async def step_users(users, load, make_user, shutdown):
+    """
+    Return load users from users that can start a new session.
+
+    Users whose server failed to stop in an earlier step are torn down
+    again. Those still left running sit the step out, and new users are
+    made with `await make_user()` and added to users to make up for them.
+    """
+    leftovers = [u for u in users if has_server(u)]
+    if leftovers:
+        await asyncio.gather(*[shutdown.teardown_user(u) for u in leftovers])
+    ready = [u for u in users if not has_server(u)][:load]
+    while len(ready) < load:
+        u = await make_user()
+        users.append(u)
+        ready.append(u)
+    return ready
+
+
+async def search(run_step, loads, bisect=False):
+    """
+    Return highest of loads for which `await run_step(load)` is True.
+
+    loads must be sorted ascending. Without bisect, loads are tried in order
+    until one fails. With bisect, success is assumed to be monotonic, and
+    loads are bisected to find the last one that passes.
+    Returns None if no load passed.
+
+    >>> asyncio.run(search(lambda load: asyncio.sleep(0, load <= 35), range(10, 101, 5)))
+    35
+    >>> asyncio.run(search(lambda load: asyncio.sleep(0, load <= 35), range(10, 101, 5), bisect=True))
+    35
+    """
+    best = None
+    if not bisect:
+        for load in loads:
+            if not await run_step(load):
+                break
+            best = load
+        return best
+
+    low, high = 0, len(loads) - 1
+    while low <= high:
+        mid = (low + high) // 2
+        if await run_step(loads[mid]):
+            best = loads[mid]
+            low = mid + 1
+        else:
+            high = mid - 1
+    return best
+
+
+async def run(args):
+    # FIXME: Pass in individual arguments, not argparse object
+    login_handler = partial(login_dummy, password='hello')
+    execute_mode = get_execute_mode(args)
+    users = []
+
+    async with contextlib.AsyncExitStack() as stack:
+        # One connection pool for all users, across all steps
+        connector = aiohttp.TCPConnector(limit=0)
+        stack.push_async_callback(connector.close)
+        monitor = None
+        if args.monitor_interval:
+            monitor = await stack.enter_async_context(
+                SaturationMonitor(args.monitor_interval, args.max_loop_lag)
+            )
+
+        async def make_user():
+            u = User(
+                f'{args.user_prefix}-{len(users)}',
+                args.hub_url,
+                login_handler,
+                connector=connector,
+            )
+            return await stack.enter_async_context(u)
+
+        async def run_step(load):
+            stats = Stats()
+            shutdown = ShutdownManager(args.teardown_concurrency, args.teardown_retries)
+            ready = await step_users(users, load, make_user, shutdown)
+            for u in ready:
+                u.stats = stats
+
+            async def session(u):
+                await asyncio.sleep(random.uniform(0, args.ramp_seconds))
+                return await user_session(
+                    u, args.step_runtime, execute_mode, args.execute_rate, shutdown
+                )
+
+            print(f'Step: {load} users')
+            start_time = time.monotonic()
+            results = await asyncio.gather(
+                *[session(u) for u in ready], return_exceptions=True
+            )
+            # A session that raised counts as failed, like in hubtraf-simulate
+            outcomes = Counter(
+                'error' if isinstance(r, Exception) else r for r in results
+            )
+            violations = check_slos(
+                stats,
+                outcomes,
+                args.slo_server_start_p95,
+                args.slo_code_execute_p99,
+                args.slo_max_failure_rate,
+            )
+            if monitor is not None and monitor.saturated_during(
+                start_time, time.monotonic()
+            ):
+                violations.append('load generator was saturated, results unreliable')
+
+            summary = stats.summary()
+            print(
+                f'Step: {load} users {"passed" if not violations else "failed"}',
+                dict(outcomes),
+                f'server-start p95:{summary.get("server-start", {}).get("p95")}',
+                f'code-execute p99:{summary.get("code-execute-iteration", {}).get("p99")}',
+            )
+            for violation in violations:
+                print(f'  {violation}')
+
+            await asyncio.sleep(args.cooldown)
+            return not violations
+
+        best = await search(
+            run_step,
+            list(range(args.start, args.max_users + 1, args.step)),
+            args.bisect,
+        )
+
+    if best is None:
+        print(f'No load met the SLOs, not even {args.start} users')
+    else:
+        print(f'Max sustainable users: {best}')
+    return best
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument(
+        'hub_url', help='Hub URL to send traffic to (without a trailing /)'
+    )
+    argparser.add_argument(
+        '--start', default=10, type=int, help='Number of users in the first step'
+    )
+    argparser.add_argument(
+        '--step', default=10, type=int, help='Users added in each step'
+    )
+    argparser.add_argument(
+        '--max-users', default=1000, type=int, help='Max number of users to try'
+    )
+    argparser.add_argument(
+        '--bisect',
+        action='store_true',
+        help='Bisect between --start and --max-users instead of stepping up one step at a time',
+    )
+    argparser.add_argument(
+        '--slo-server-start-p95',
+        type=float,
+        help='Max seconds for the 95th percentile of server starts',
+    )
+    argparser.add_argument(
+        '--slo-code-execute-p99',
+        type=float,
+        help='Max seconds for the 99th percentile of code executions',
+    )
+    argparser.add_argument(
+        '--slo-max-failure-rate',
+        type=float,
+        default=0.01,
+        help='Max fraction of users that may fail their session',
+    )
+    argparser.add_argument(
+        '--user-prefix',
+        default=socket.gethostname(),
+        help='Prefix to use when generating user names',
+    )
+    argparser.add_argument(
+        '--ramp-seconds',
+        default=60,
+        type=int,
+        help='Seconds over which users of a step start their sessions',
+    )
+    argparser.add_argument(
+        '--step-runtime',
+        default=60,
+        type=int,
+        help='Seconds each user runs code for in a step',
+    )
+    argparser.add_argument(
+        '--cooldown',
+        default=30,
+        type=int,
+        help='Seconds to wait between steps, for the hub to settle',
+    )
+    add_execute_arguments(argparser)
+    add_teardown_arguments(argparser)
+    add_monitor_arguments(argparser)
+    argparser.add_argument(
+        '--json', action='store_true', help='True if output should be JSON formatted'
+    )
+    args = argparser.parse_args()
+
+    check_execute_arguments(argparser, args)
+
+    configure_structlog(args.json)
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,16 @@
 import argparse
 import asyncio
 import os
+import re
 import secrets
+import sys
+import time
+from collections import defaultdict
 
+import aiohttp
+
+from hubtraf.poller import ServerStatusPoller
+from hubtraf.stats import Stats
 from hubtraf.user import User
 
 
@@ -10,26 +18,135 @@ async def no_auth(*args, **kwargs):
     return True
 
 
-async def check_user(hub_url, username, api_token):
-    async with User(username, hub_url, no_auth) as u:
+def expand_usernames(patterns):
+    """
+    Expand bash-style {start..end} ranges in each of the given usernames.
+
+    Useful when the shell doesn't do it for us, such as when passing
+    arguments from a kubernetes manifest.
+
+    >>> expand_usernames(['admin', 'user-{1..3}'])
+    ['admin', 'user-1', 'user-2', 'user-3']
+    """
+    usernames = []
+    for pattern in patterns:
+        match = re.search(r'\{(\d+)\.\.(\d+)\}', pattern)
+        if not match:
+            usernames.append(pattern)
+            continue
+        prefix, suffix = pattern[: match.start()], pattern[match.end() :]
+        for i in range(int(match.group(1)), int(match.group(2)) + 1):
+            usernames.extend(expand_usernames([f'{prefix}{i}{suffix}']))
+    return usernames
+
+
+async def check_user(
+    hub_url,
+    username,
+    api_token,
+    deadline=None,
+    connector=None,
+    stats=None,
+    poller=None,
+):
+    """
+    Start a server & kernel for username, run some code and clean up.
+
+    Returns 'completed' on success, or the name of the stage that failed.
+    If deadline (in seconds) is set, any stage still running once it has
+    passed is considered to have failed. Cleanup is not subject to it, and
+    stops servers whose start timed out too.
+    """
+    if deadline is not None:
+        deadline_time = time.monotonic() + deadline
+
+    async def step(kind, coro):
+        if deadline is None:
+            return await coro
+        start_time = time.monotonic()
         try:
-            if not await u.ensure_server_api(api_token):
-                return 'start-server'
-            if not await u.start_kernel():
-                return 'start-kernel'
-            nonce = secrets.token_hex(64)
-            if not await u.assert_code_output(
-                f"!echo -n {nonce} > nonce \n!cat nonce", nonce, 2
+            return await asyncio.wait_for(coro, deadline_time - start_time)
+        except asyncio.TimeoutError:
+            u.failure(kind, reason='timeout', duration=time.monotonic() - start_time)
+            return False
+
+    result = 'completed'
+    async with User(username, hub_url, no_auth, connector, stats) as u:
+        try:
+            if not await step(
+                'server-start', u.ensure_server_api(api_token, poller=poller)
             ):
-                return 'run-code'
+                result = 'start-server'
+            elif not await step('kernel-start', u.start_kernel()):
+                result = 'start-kernel'
+            else:
+                nonce = secrets.token_hex(64)
+                if not await step(
+                    'code-execute',
+                    u.assert_code_output(
+                        f"!echo -n {nonce} > nonce \n!cat nonce", nonce, 2
+                    ),
+                ):
+                    result = 'run-code'
         finally:
             if u.state == User.States.KERNEL_STARTED:
-                if not await u.stop_kernel():
-                    return 'stop-kernel'
-            if u.state == User.States.SERVER_STARTED:
-                if not await u.stop_server():
-                    return 'stop-kernel'
-            return 'completed'
+                if not await u.stop_kernel() and result == 'completed':
+                    result = 'stop-kernel'
+            if u.state == User.States.SERVER_STARTED or u.spawn_requested:
+                if not await u.stop_server() and result == 'completed':
+                    result = 'stop-server'
+    return result
+
+
+async def check_users(hub_url, usernames, api_token, concurrency=50, deadline=300):
+    """
+    Check all usernames concurrently, sharing one connection pool and one
+    poller for server status.
+
+    At most concurrency users are checked at the same time.
+    Returns ({username: result}, Stats)
+    """
+    stats = Stats()
+    semaphore = asyncio.Semaphore(concurrency)
+    # Concurrency is capped by the semaphore, not by the pool
+    connector = aiohttp.TCPConnector(limit=0)
+
+    async def check_one(username):
+        async with semaphore:
+            return await check_user(
+                hub_url, username, api_token, deadline, connector, stats, poller
+            )
+
+    try:
+        async with ServerStatusPoller(hub_url, api_token) as poller:
+            results = await asyncio.gather(*[check_one(u) for u in usernames])
+    finally:
+        await connector.close()
+    return dict(zip(usernames, results)), stats
+
+
+def print_report(results, stats):
+    """
+    Print per-step latency percentiles and failing users grouped by stage
+    """
+    print('Step latencies:')
+    for kind, summary in stats.summary().items():
+        summary_pretty = " ".join(
+            [f"{k}:{round(v, 3)}" for k, v in summary.items() if k != 'count']
+        )
+        print(f'  {kind} count:{summary["count"]} {summary_pretty}')
+
+    completed = 0
+    failed = defaultdict(list)
+    for username, result in results.items():
+        if result == 'completed':
+            completed += 1
+        else:
+            failed[result].append(username)
+
+    print(f'Checked {len(results)} users, {completed} completed')
+    for stage, usernames in sorted(failed.items()):
+        print(f'  {stage} failed for {len(usernames)} users: {" ".join(usernames)}')
 
 
 def main():
@@ -37,13 +154,40 @@ def main():
     argparser.add_argument(
         'hub_url', help='Hub URL to send traffic to (without a trailing /)'
     )
-    argparser.add_argument('username', help='Name of user to check')
+    argparser.add_argument(
+        'usernames',
+        nargs='+',
+        help='Names of users to check. {start..end} ranges are expanded, eg. user-{1..100}',
+    )
+    argparser.add_argument(
+        '--concurrency',
+        default=50,
+        type=int,
+        help='Max number of users to check at the same time',
+    )
+    argparser.add_argument(
+        '--deadline',
+        default=300,
+        type=int,
+        help='Max seconds each user check may take before it is considered failed',
+    )
     args = argparser.parse_args()
 
     api_token = os.environ['JUPYTERHUB_API_TOKEN']
 
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(check_user(args.hub_url, args.username, api_token))
+    results, stats = loop.run_until_complete(
+        check_users(
+            args.hub_url,
+            expand_usernames(args.usernames),
+            api_token,
+            args.concurrency,
+            args.deadline,
+        )
+    )
+    print_report(results, stats)
+    if any(result != 'completed' for result in results.values()):
+        sys.exit(1)
 
 
 if __name__ == '__main__':
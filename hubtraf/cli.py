@@ -0,0 +1,80 @@
+"""
+Command line arguments & setup shared by hubtraf's commands
+"""
+
+import structlog
+
+from hubtraf.user import User
+
+
+def add_execute_arguments(argparser):
+    argparser.add_argument(
+        '--execute-mode',
+        default='think',
+        choices=['think', 'closed-loop', 'fixed-rate'],
+        help='How to pace code executions: random pauses, back-to-back, or at --execute-rate',
+    )
+    argparser.add_argument(
+        '--execute-rate',
+        type=float,
+        help='Target executes/sec per kernel when --execute-mode is fixed-rate',
+    )
+
+
+def check_execute_arguments(argparser, args):
+    """
+    Exit with a usage error if args added by add_execute_arguments don't fit together
+    """
+    if args.execute_mode == 'fixed-rate' and not args.execute_rate:
+        argparser.error('--execute-rate is required with --execute-mode fixed-rate')
+
+
+def get_execute_mode(args):
+    """
+    Return the User.ExecuteModes picked with --execute-mode
+    """
+    return User.ExecuteModes[args.execute_mode.upper().replace('-', '_')]
+
+
+def add_teardown_arguments(argparser):
+    argparser.add_argument(
+        '--teardown-concurrency',
+        default=50,
+        type=int,
+        help='Max number of users whose kernel & server are stopped at the same time',
+    )
+    argparser.add_argument(
+        '--teardown-retries',
+        default=3,
+        type=int,
+        help='Times to retry stopping a kernel or server that failed to stop',
+    )
+
+
+def add_monitor_arguments(argparser):
+    argparser.add_argument(
+        '--monitor-interval',
+        default=1,
+        type=float,
+        help='Seconds between samples of our own event loop lag, CPU & memory, 0 to disable',
+    )
+    argparser.add_argument(
+        '--max-loop-lag',
+        default=0.1,
+        type=float,
+        help='Event loop lag in seconds above which the load generator counts as saturated',
+    )
+
+
+def configure_structlog(json=False):
+    """
+    Log with ISO timestamps, as JSON if json is True or for the console otherwise
+    """
+    processors = [structlog.processors.TimeStamper(fmt="ISO")]
+
+    if json:
+        processors.append(structlog.processors.JSONRenderer())
+    else:
+        processors.append(structlog.dev.ConsoleRenderer())
+
+    structlog.configure(processors=processors)
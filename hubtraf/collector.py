@@ -0,0 +1,294 @@
+"""
+Collect hubtraf events over the fluent forward protocol.
+
+fluent-bit (or anything else speaking the forward protocol) sends events
+here, and they are written out in batches as parquet files partitioned by
+hour, sorted by time. These can be loaded with
+hubtraf.analysis.dataframe.collected_to_df without a prepare_data pass.
+
+Needs the 'collector' extra: pip install hubtraf[collector]
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import signal
+import struct
+import time
+from datetime import datetime, timezone
+
+import msgpack
+import pandas as pd
+
+
+def unpack_ext(code, data):
+    """
+    Decode fluent's EventTime extension type into float seconds
+    """
+    if code == 0:
+        seconds, nanoseconds = struct.unpack('>II', data)
+        return seconds + nanoseconds / 1e9
+    return msgpack.ExtType(code, data)
+
+
+def message_option(message):
+    """
+    Return option map of a forward protocol message, or {} if it has none
+    """
+    option_index = 3 if isinstance(message[1], (int, float)) else 2
+    if len(message) > option_index and isinstance(message[option_index], dict):
+        return message[option_index]
+    return {}
+
+
+def entries(message):
+    """
+    Yield (time, record) of each event in a forward protocol message.
+
+    Supports Message, Forward, PackedForward & CompressedPackedForward modes.
+    """
+    if isinstance(message[1], (int, float)):
+        # Message mode: [tag, time, record, option?]
+        yield message[1], message[2]
+    elif isinstance(message[1], list):
+        # Forward mode: [tag, [[time, record], ...], option?]
+        for entry in message[1]:
+            yield entry[0], entry[1]
+    else:
+        # PackedForward mode: [tag, msgpack stream of [time, record], option?]
+        data = message[1]
+        if message_option(message).get('compressed') == 'gzip':
+            data = gzip.decompress(data)
+        unpacker = msgpack.Unpacker(raw=False, ext_hook=unpack_ext)
+        unpacker.feed(data)
+        for entry in unpacker:
+            yield entry[0], entry[1]
+
+
+def record_to_event(event_time, record):
+    """
+    Return hubtraf event from a fluent record, or None if it isn't one.
+
+    Records tailed from hubtraf's output have the JSON event as a string
+    under 'log', records from anything else are assumed to be the event.
+    """
+    log = record.get('log')
+    if isinstance(log, str):
+        try:
+            event = json.loads(log)
+        except ValueError:
+            return None
+    else:
+        event = record
+    if not isinstance(event, dict):
+        return None
+    if 'timestamp' not in event:
+        # Same format as structlog's TimeStamper(fmt='ISO')
+        event['timestamp'] = datetime.fromtimestamp(event_time, timezone.utc).strftime(
+            '%Y-%m-%dT%H:%M:%S.%fZ'
+        )
+    return event
+
+
+def partition_of(event):
+    """
+    Return partition of event, by hour of its ISO formatted timestamp
+
+    >>> partition_of({'timestamp': '2018-03-09T04:49:40.336049Z'})
+    'date=2018-03-09/hour=04'
+    """
+    timestamp = event['timestamp']
+    return f'date={timestamp[:10]}/hour={timestamp[11:13]}'
+
+
+def write_partition(path, events):
+    """
+    Write events, sorted by time, as a parquet file at path
+    """
+    df = pd.DataFrame(events)
+    for column in df.columns:
+        if df[column].dtype == object:
+            # parquet columns need a single type
+            df[column] = df[column].map(
+                lambda v: v if v is None or isinstance(v, str) else json.dumps(v)
+            )
+    df.sort_values('timestamp', inplace=True, kind='stable')
+    directory, filename = os.path.split(path)
+    os.makedirs(directory, exist_ok=True)
+    # Write to a hidden name first so readers never see partial files
+    tmp_path = os.path.join(directory, f'.{filename}.tmp')
+    df.to_parquet(tmp_path, index=False)
+    os.rename(tmp_path, path)
+
+
+class Collector:
+    """
+    Receive events over the forward protocol & write them out in batches.
+
+    Events are flushed once batch_size of them are pending, or every
+    flush_interval seconds. Chunks are acknowledged when received, not
+    when written, so events pending when the collector is killed are lost.
+    """
+
+    def __init__(self, outdir, batch_size=10000, flush_interval=10):
+        self.outdir = outdir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.batch_full = asyncio.Event()
+        self.flush_lock = asyncio.Lock()
+        # Unique prefix for our files, so restarts don't overwrite them
+        self.file_prefix = f'part-{int(time.time())}'
+        self.files_written = 0
+        self.events_written = 0
+        self.connections = set()
+
+    def add(self, message):
+        for event_time, record in entries(message):
+            event = record_to_event(event_time, record)
+            if event is not None:
+                self.pending.append(event)
+        if len(self.pending) >= self.batch_size:
+            self.batch_full.set()
+
+    async def handle(self, reader, writer):
+        unpacker = msgpack.Unpacker(raw=False, ext_hook=unpack_ext)
+        self.connections.add(writer)
+        try:
+            while True:
+                data = await reader.read(64 * 1024)
+                if not data:
+                    break
+                unpacker.feed(data)
+                for message in unpacker:
+                    self.add(message)
+                    option = message_option(message)
+                    if 'chunk' in option:
+                        writer.write(msgpack.packb({'ack': option['chunk']}))
+                        await writer.drain()
+        except ConnectionError as e:
+            print(f'Dropping connection: {e!r}')
+        except (ValueError, TypeError, KeyError, IndexError, AttributeError) as e:
+            # Raised for corrupt data, or messages that aren't shaped like
+            # forward protocol messages. Drop the connection.
+            print(f'Dropping connection: {e!r}')
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    async def flush(self):
+        async with self.flush_lock:
+            events, self.pending = self.pending, []
+            if not events:
+                return
+            partitions = {}
+            for event in events:
+                partitions.setdefault(partition_of(event), []).append(event)
+
+            loop = asyncio.get_running_loop()
+            for partition, partition_events in partitions.items():
+                path = os.path.join(
+                    self.outdir,
+                    partition,
+                    f'{self.file_prefix}-{self.files_written:06}.parquet',
+                )
+                self.files_written += 1
+                # Don't block receiving events while writing
+                await loop.run_in_executor(
+                    None, write_partition, path, partition_events
+                )
+            self.events_written += len(events)
+
+    async def flush_periodically(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.batch_full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.batch_full.clear()
+            await self.flush()
+
+    async def serve(self, host, port, stop):
+        """
+        Serve until stop (an asyncio.Event) is set, then flush pending events
+        """
+        server = await asyncio.start_server(self.handle, host, port)
+        flusher = asyncio.ensure_future(self.flush_periodically())
+        try:
+            await stop.wait()
+        finally:
+            server.close()
+            for writer in list(self.connections):
+                writer.close()
+            await server.wait_closed()
+            flusher.cancel()
+            try:
+                await flusher
+            except asyncio.CancelledError:
+                pass
+            await self.flush()
+
+
+async def forward_events(host, port, tag, records, chunk='hubtraf'):
+    """
+    Send records as one PackedForward message & wait for it to be acked.
+
+    A minimal forward protocol client, for testing the collector locally.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        now = time.time()
+        packed = b''.join(msgpack.packb([now, record]) for record in records)
+        writer.write(msgpack.packb([tag, packed, {'chunk': chunk}]))
+        await writer.drain()
+        unpacker = msgpack.Unpacker(raw=False)
+        while True:
+            data = await reader.read(1024)
+            if not data:
+                raise ConnectionError('Connection closed before ack')
+            unpacker.feed(data)
+            for response in unpacker:
+                if response.get('ack') == chunk:
+                    return
+    finally:
+        writer.close()
+
+
+async def run(args):
+    collector = Collector(args.outdir, args.batch_size, args.flush_interval)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    print(f'Collecting events on {args.host}:{args.port} into {args.outdir}')
+    await collector.serve(args.host, args.port, stop)
+    print(f'Wrote {collector.events_written} events in {collector.files_written} files')
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('outdir', help='Directory to write parquet files to')
+    argparser.add_argument('--host', default='0.0.0.0', help='Address to listen on')
+    argparser.add_argument('--port', default=24224, type=int, help='Port to listen on')
+    argparser.add_argument(
+        '--batch-size',
+        default=10000,
+        type=int,
+        help='Write events out once this many are pending',
+    )
+    argparser.add_argument(
+        '--flush-interval',
+        default=10,
+        type=float,
+        help='Max seconds events are kept pending before being written out',
+    )
+    args = argparser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
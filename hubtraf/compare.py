@@ -0,0 +1,223 @@
+"""
+Compare two processed hubtraf logs, and fail if performance regressed.
+
+Both logs are streamed line by line. Exact success & failure counts are kept
+per action, but only a fixed size random sample (a reservoir) of durations,
+so memory use doesn't grow with the size of the logs.
+"""
+
+import argparse
+import json
+import math
+import random
+import sys
+
+import numpy as np
+
+from hubtraf.analysis.accumulators import is_failure
+from hubtraf.parser.compression import open_log
+
+STATS = ['mean', 'p50', 'p95', 'p99']
+
+
+def duration_stats(samples):
+    """
+    Return {stat: value} of each of STATS, over the last axis of samples
+    """
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99], axis=-1)
+    return {'mean': samples.mean(axis=-1), 'p50': p50, 'p95': p95, 'p99': p99}
+
+
+class ActionSample:
+    """
+    Counts & a reservoir sample of durations for one action in a log
+    """
+
+    def __init__(self, size, rng):
+        self.size = size
+        self.rng = rng
+        self.completed = 0
+        self.failed = 0
+        self.durations = []
+
+    def add_duration(self, duration):
+        self.completed += 1
+        if len(self.durations) < self.size:
+            self.durations.append(duration)
+        else:
+            # Algorithm R: keep each duration seen with equal probability
+            i = self.rng.randrange(self.completed)
+            if i < self.size:
+                self.durations[i] = duration
+
+    @property
+    def failure_rate(self):
+        total = self.completed + self.failed
+        return self.failed / total if total else 0
+
+
+def load_log(path, reservoir_size=5000, seed=0):
+    """
+    Stream a processed, possibly compressed, log, returning {action: ActionSample}
+    """
+    rng = random.Random(seed)
+    actions = {}
+    with open_log(path) as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            action = event.get('action')
+            phase = event.get('phase') or ''
+            if action is None:
+                continue
+            if action not in actions:
+                actions[action] = ActionSample(reservoir_size, rng)
+            if phase == 'complete' and event.get('duration') is not None:
+                actions[action].add_duration(event['duration'])
+            elif is_failure(phase):
+                actions[action].failed += 1
+    return actions
+
+
+def bootstrap_changes(before, after, resamples=1000, seed=0, batch_size=100):
+    """
+    Relative change in each of STATS from before to after durations, with 95% CIs.
+
+    Each resample is drawn once, and all stats are computed from it, with
+    batch_size resamples at a time in one numpy array.
+    Returns {stat: (change, low, high)}, as fractions (0.1 is 10% slower).
+    """
+    rng = np.random.default_rng(seed)
+    before = np.asarray(before, dtype=float)
+    after = np.asarray(after, dtype=float)
+
+    def relative_change(b, a):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(b > 0, a / b - 1, math.inf)
+
+    base, current = duration_stats(before), duration_stats(after)
+    changes = {stat: [] for stat in STATS}
+    for start in range(0, resamples, batch_size):
+        size = min(batch_size, resamples - start)
+        b = duration_stats(rng.choice(before, (size, len(before))))
+        a = duration_stats(rng.choice(after, (size, len(after))))
+        for stat in STATS:
+            changes[stat].append(relative_change(b[stat], a[stat]))
+
+    result = {}
+    for stat in STATS:
+        low, high = np.percentile(np.concatenate(changes[stat]), [2.5, 97.5])
+        change = relative_change(base[stat], current[stat])
+        result[stat] = (float(change), float(low), float(high))
+    return result
+
+
+def failure_rate_change(before, after):
+    """
+    Absolute change in failure rate from before to after, with a 95% CI
+    """
+    n1 = before.completed + before.failed
+    n2 = after.completed + after.failed
+    p1, p2 = before.failure_rate, after.failure_rate
+    change = p2 - p1
+    if not n1 or not n2:
+        return change, change, change
+    margin = 1.96 * math.sqrt(p1 * (1 - p1) / n1 + p2 * (1 - p2) / n2)
+    return change, change - margin, change + margin
+
+
+def parse_threshold(spec):
+    """
+    Parse a threshold of form action:stat=value
+
+    >>> parse_threshold('server-start:p95=20')
+    ('server-start', 'p95', 20.0)
+    >>> parse_threshold('*:failure_rate=0.05')
+    ('*', 'failure_rate', 0.05)
+    """
+    target, value = spec.rsplit('=', 1)
+    action, stat = target.rsplit(':', 1)
+    if stat not in STATS and stat != 'failure_rate':
+        raise ValueError(f'Unknown stat {stat} in threshold {spec}')
+    return action, stat, float(value)
+
+
+def compare(before, after, thresholds, resamples=1000):
+    """
+    Compare {action: ActionSample} of two logs against thresholds.
+
+    Thresholds are (action, stat, value) tuples. action may be '*' to apply to
+    all actions. For duration stats value is the max allowed % slowdown, for
+    failure_rate the max allowed absolute increase. A threshold only counts as
+    regressed if the whole 95% confidence interval is past it.
+
+    Returns list of (action, stat, change, low, high, regressed) rows.
+    """
+    rows = []
+    for action in sorted(set(before) & set(after)):
+        changes = {}
+        if before[action].durations and after[action].durations:
+            changes = bootstrap_changes(
+                before[action].durations, after[action].durations, resamples
+            )
+        changes['failure_rate'] = failure_rate_change(before[action], after[action])
+        for stat in STATS + ['failure_rate']:
+            if stat not in changes:
+                continue
+            change, low, high = changes[stat]
+            regressed = False
+            for t_action, t_stat, t_value in thresholds:
+                if t_action in ('*', action) and t_stat == stat:
+                    limit = t_value if stat == 'failure_rate' else t_value / 100
+                    if low > limit:
+                        regressed = True
+            rows.append((action, stat, change, low, high, regressed))
+    return rows
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('before', help='Processed log of the baseline run')
+    argparser.add_argument('after', help='Processed log of the run to check')
+    argparser.add_argument(
+        '--threshold',
+        action='append',
+        default=[],
+        help='action:stat=value, eg. server-start:p95=20 to fail if p95 of server-start '
+        'got more than 20%% slower, or *:failure_rate=0.05 to fail if any action '
+        'failed 5 percentage points more often. Can be given multiple times',
+    )
+    argparser.add_argument(
+        '--resamples', default=1000, type=int, help='Bootstrap resamples'
+    )
+    argparser.add_argument(
+        '--sample-size',
+        default=5000,
+        type=int,
+        help='Max durations kept per action in each log',
+    )
+    args = argparser.parse_args()
+
+    thresholds = [parse_threshold(t) for t in args.threshold]
+    before = load_log(args.before, args.sample_size)
+    after = load_log(args.after, args.sample_size)
+
+    regressed = False
+    for action, stat, change, low, high, is_regressed in compare(
+        before, after, thresholds, args.resamples
+    ):
+        if stat == 'failure_rate':
+            pretty = f'{change:+.2%} [{low:+.2%}, {high:+.2%}] (absolute)'
+        else:
+            pretty = f'{change:+.1%} [{low:+.1%}, {high:+.1%}]'
+        print(f'{action} {stat}: {pretty}{" REGRESSED" if is_regressed else ""}')
+        regressed = regressed or is_regressed
+
+    if regressed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
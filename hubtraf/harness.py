@@ -0,0 +1,642 @@
+"""
+Run hubtraf-simulate against an in-process fake hub, in virtual time.
+
+Every sleep - user arrival delays, think time, spawn polling, the fake hub's
+spawn & execute times - is fast-forwarded by an event loop with a virtual
+clock, so hours of simulated time take seconds. Runs are seeded, so the same
+arguments give the same schedule & outcomes. This is for checking the
+simulator's own scheduling, admission & retry behavior with many users, and
+for benchmarking how much CPU it spends per user - not for measuring a real
+hub.
+
+Users talk to the fake hub through a FakeSession, which stands in for
+aiohttp's ClientSession and calls the hub in-process - there are no sockets,
+no HTTP or websocket framing and no JSON. So a run's CPU is nearly all the
+simulator's own: User, hubtraf-simulate's scheduling & the event loop. The
+fake hub times itself, and its share is reported separately.
+
+Runs are still bound by CPU, and it is spent per code execution, not per
+virtual second - about 0.05ms of simulator CPU each. With the default session
+lengths & think time users run a few hundred executions each, so expect
+roughly 20ms per user: 20s for 1000 users, or over half an hour for 100k.
+Shorter sessions (--user-session-*-runtime) make runs with more users
+proportionally cheaper - 10k users with 10-20s sessions take about 30s.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import heapq
+import os
+import random
+import re
+import selectors
+import time
+import uuid
+from collections import Counter
+from functools import partial
+from http.cookies import SimpleCookie
+
+import aiohttp
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+from hubtraf import simulate
+from hubtraf.cli import (
+    add_execute_arguments,
+    add_teardown_arguments,
+    check_execute_arguments,
+)
+
+
+class _FastForwardSelector(selectors.DefaultSelector):
+    """
+    Selector that advances the loop's virtual clock instead of waiting
+    """
+
+    def __init__(self, loop):
+        super().__init__()
+        self.loop = loop
+
+    def select(self, timeout=None):
+        events = super().select(0)
+        if events or (timeout is not None and timeout <= 0):
+            return events
+        if timeout is None:
+            # Nothing scheduled, so only real I/O can wake us up
+            return super().select(None)
+        # Nothing to do until the next timer, so jump straight to it
+        self.loop.now += timeout
+        return []
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """
+    Event loop whose clock only moves forward when it has nothing else to do.
+
+    Sockets are still real, but if a socket has data in flight when the loop
+    goes idle its timers fire early. hubtraf-harness doesn't use any.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        super().__init__(_FastForwardSelector(self))
+
+    def time(self):
+        return self.now
+
+
+def run_virtual(main, seed=0):
+    """
+    Run coroutine main to completion on a VirtualClockLoop, returning its result.
+
+    The random module is seeded with seed. Code in main that should follow the
+    virtual clock has to use loop.time(), eg. by passing it as clock to User.
+    """
+    loop = VirtualClockLoop()
+    random.seed(seed)
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(main)
+    finally:
+        try:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+
+class FakeResponse:
+    """
+    A response from FakeHub, with the parts of aiohttp's ClientResponse User uses
+
+    cookies maps names of cookies to set to their (value, path).
+    """
+
+    def __init__(self, status=200, body=None, location=None, cookies=None):
+        self.status = status
+        self.body = body
+        self.location = location
+        self.cookies = cookies or {}
+        # Set by FakeSession, to the url the response came from
+        self.url = None
+
+    async def json(self):
+        return self.body
+
+    async def text(self):
+        return self.body
+
+    async def close(self):
+        pass
+
+    def __repr__(self):
+        return f'<FakeResponse({self.url}) [{self.status}]>'
+
+
+class FakeMessage:
+    """
+    A websocket message from the fake kernel, already decoded
+    """
+
+    type = aiohttp.WSMsgType.TEXT
+
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class _RequestContextManager:
+    """
+    Make the result of coro awaitable or usable with async with, like aiohttp does
+    """
+
+    def __init__(self, coro):
+        self.coro = coro
+
+    def __await__(self):
+        return self.coro.__await__()
+
+    async def __aenter__(self):
+        self.response = await self.coro
+        return self.response
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.response.close()
+
+
+class FakeWebSocket:
+    """
+    Kernel channels websocket of FakeHub, passing messages as dicts
+    """
+
+    def __init__(self, hub, kernel_id):
+        self.hub = hub
+        self.kernel_id = kernel_id
+        # Replies to the last execute_request that are ready to be received,
+        # & those only sent once execute_time has passed. Both are reversed,
+        # to pop from the end.
+        self.replies = []
+        self.finished = None
+
+    async def send_json(self, data):
+        replies = self.hub.execute(self.kernel_id, data)
+        if replies is None:
+            # The kernel is gone, so the websocket closes
+            self.replies, self.finished = [], None
+        else:
+            started, finished = replies
+            self.replies, self.finished = started[::-1], finished[::-1]
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.replies:
+            if not self.finished:
+                raise StopAsyncIteration
+            await asyncio.sleep(self.hub.execute_time)
+            self.replies, self.finished = self.finished, None
+        return FakeMessage(self.replies.pop())
+
+    async def close(self):
+        self.replies, self.finished = [], None
+
+
+class FakeSession:
+    """
+    Stand-in for aiohttp's ClientSession that calls hub in-process.
+
+    Nothing is serialized: request data, response bodies & websocket messages
+    are passed to & from hub as Python objects. Cookies are kept in a real
+    aiohttp CookieJar, so User & the login handlers can read them as usual.
+    """
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.cookie_jar = aiohttp.CookieJar()
+        self.headers = {}
+
+    def _cookies(self, url):
+        return {
+            name: morsel.value
+            for name, morsel in self.cookie_jar.filter_cookies(url).items()
+        }
+
+    async def _request(self, method, url, data=None, allow_redirects=True):
+        # Give other users a turn, like waiting for a real response would
+        await asyncio.sleep(0)
+        while True:
+            response = self.hub.handle(method, url.path, self._cookies(url), data)
+            response.url = url
+            if response.cookies:
+                cookies = SimpleCookie()
+                for name, (value, path) in response.cookies.items():
+                    cookies[name] = value
+                    cookies[name]['path'] = path
+                self.cookie_jar.update_cookies(cookies, url)
+            if not (allow_redirects and response.location):
+                return response
+            url = url.join(URL(response.location))
+            method = 'GET'
+            data = None
+
+    def request(self, method, url, data=None, allow_redirects=True, **kwargs):
+        return _RequestContextManager(
+            self._request(method, URL(url), data, allow_redirects)
+        )
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    async def _ws_connect(self, url):
+        response = await self._request('GET', url, allow_redirects=False)
+        if response.status != 101:
+            raise aiohttp.WSServerHandshakeError(
+                aiohttp.RequestInfo(url, 'GET', CIMultiDictProxy(CIMultiDict()), url),
+                (),
+                status=response.status,
+                message='Invalid response status',
+            )
+        return FakeWebSocket(self.hub, response.body)
+
+    def ws_connect(self, url, **kwargs):
+        return _RequestContextManager(self._ws_connect(URL(url)))
+
+    async def close(self):
+        pass
+
+
+class FakeHub:
+    """
+    Just enough of JupyterHub & notebook servers for User to run a session.
+
+    spawn_time - seconds a server takes to start, +/- spawn_jitter as a fraction
+    spawn_failure_rate - fraction of spawns that fail once spawn_time is up
+    concurrent_spawn_limit - like JupyterHub's, spawns requested while this
+                             many are pending are rejected with a 429
+    stop_failure_rate - fraction of server stops that fail with a 500
+    execute_time - seconds the kernel takes for each execution
+    outputs - {code: output} the kernel produces, anything else errors
+
+    Users talk to it through a FakeSession. Counts of what happened are kept
+    in self.counts, and the CPU seconds spent in the hub itself in self.cpu.
+    """
+
+    def __init__(
+        self,
+        spawn_time=10,
+        spawn_jitter=0.5,
+        spawn_failure_rate=0,
+        concurrent_spawn_limit=None,
+        stop_failure_rate=0,
+        execute_time=0.01,
+        outputs=None,
+        seed=0,
+    ):
+        self.spawn_time = spawn_time
+        self.spawn_jitter = spawn_jitter
+        self.spawn_failure_rate = spawn_failure_rate
+        self.concurrent_spawn_limit = concurrent_spawn_limit
+        self.stop_failure_rate = stop_failure_rate
+        self.execute_time = execute_time
+        self.outputs = outputs if outputs is not None else {'5 * 4': '20'}
+        self.rng = random.Random(seed)
+        # username -> (time server is ready at, whether the spawn fails)
+        self.servers = {}
+        # (ready at, username) of spawns that may still be pending
+        self.pending = []
+        self.kernels = {}
+        self.counts = Counter()
+        self.cpu = 0
+
+        self.routes = [
+            (method, re.compile(pattern), handler)
+            for method, pattern, handler in [
+                ('GET', '/hub/login', self.login_page),
+                ('POST', '/hub/login', self.login),
+                ('GET', '/hub/spawn', self.spawn),
+                ('DELETE', '/hub/api/users/(?P<name>[^/]+)/server', self.stop_server),
+                ('GET', '/user/(?P<name>[^/]+)/tree', self.tree),
+                ('POST', '/user/(?P<name>[^/]+)/api/kernels', self.start_kernel),
+                (
+                    'DELETE',
+                    '/user/(?P<name>[^/]+)/api/kernels/(?P<kernel_id>[^/]+)',
+                    self.stop_kernel,
+                ),
+                (
+                    'GET',
+                    '/user/(?P<name>[^/]+)/api/kernels/(?P<kernel_id>[^/]+)/channels',
+                    self.channels,
+                ),
+            ]
+        ]
+
+    def handle(self, method, path, cookies, data=None):
+        """
+        Return the FakeResponse to a request
+        """
+        start = time.process_time()
+        try:
+            for route_method, pattern, handler in self.routes:
+                if route_method != method:
+                    continue
+                match = pattern.fullmatch(path)
+                if match:
+                    return handler(match.groupdict(), cookies, data)
+            return FakeResponse(404)
+        finally:
+            self.cpu += time.process_time() - start
+
+    def pending_spawns(self, now):
+        while self.pending and self.pending[0][0] <= now:
+            heapq.heappop(self.pending)
+        return len(self.pending)
+
+    def server_ready(self, username, now):
+        """
+        Return True if username's server is running, None if it is pending
+        """
+        if username not in self.servers:
+            return False
+        ready_at, fails = self.servers[username]
+        if ready_at > now:
+            return None
+        if fails:
+            del self.servers[username]
+            self.counts['spawn-failed'] += 1
+            return False
+        return True
+
+    def xsrf_cookie(self, path='/'):
+        return {'_xsrf': (uuid.UUID(int=self.rng.getrandbits(128)).hex, path)}
+
+    def login_page(self, match_info, cookies, data):
+        return FakeResponse(body='login', cookies=self.xsrf_cookie())
+
+    def login(self, match_info, cookies, data):
+        self.counts['login'] += 1
+        return FakeResponse(
+            302,
+            location='/hub/home',
+            cookies={'jupyterhub-hub-login': (data['username'], '/')},
+        )
+
+    def spawn(self, match_info, cookies, data):
+        username = cookies.get('jupyterhub-hub-login')
+        if username is None:
+            return FakeResponse(403)
+        now = asyncio.get_running_loop().time()
+        ready = self.server_ready(username, now)
+        if ready:
+            return FakeResponse(302, location=f'/user/{username}/tree')
+        if ready is False:
+            pending = self.pending_spawns(now)
+            if (
+                self.concurrent_spawn_limit is not None
+                and pending >= self.concurrent_spawn_limit
+            ):
+                self.counts['spawn-rejected'] += 1
+                return FakeResponse(429, body='Too many users trying to log in')
+            ready_at = now + self.spawn_time * self.rng.uniform(
+                1 - self.spawn_jitter, 1 + self.spawn_jitter
+            )
+            self.servers[username] = (
+                ready_at,
+                self.rng.random() < self.spawn_failure_rate,
+            )
+            heapq.heappush(self.pending, (ready_at, username))
+            self.counts['spawn-started'] += 1
+            self.counts['max-pending-spawns'] = max(
+                self.counts['max-pending-spawns'], pending + 1
+            )
+        return FakeResponse(body='Your server is starting up')
+
+    def stop_server(self, match_info, cookies, data):
+        username = match_info['name']
+        if self.rng.random() < self.stop_failure_rate:
+            self.counts['stop-failed'] += 1
+            return FakeResponse(500)
+        self.servers.pop(username, None)
+        for kernel_id in [k for k, u in self.kernels.items() if u == username]:
+            del self.kernels[kernel_id]
+        self.counts['stop'] += 1
+        return FakeResponse(204)
+
+    def tree(self, match_info, cookies, data):
+        username = match_info['name']
+        now = asyncio.get_running_loop().time()
+        if not self.server_ready(username, now):
+            return FakeResponse(503)
+        return FakeResponse(body='tree', cookies=self.xsrf_cookie(f'/user/{username}/'))
+
+    def start_kernel(self, match_info, cookies, data):
+        kernel_id = str(uuid.UUID(int=self.rng.getrandbits(128)))
+        self.kernels[kernel_id] = match_info['name']
+        self.counts['max-kernels'] = max(self.counts['max-kernels'], len(self.kernels))
+        return FakeResponse(201, body={'id': kernel_id})
+
+    def stop_kernel(self, match_info, cookies, data):
+        if self.kernels.pop(match_info['kernel_id'], None) is None:
+            return FakeResponse(404)
+        return FakeResponse(204)
+
+    def channels(self, match_info, cookies, data):
+        if match_info['kernel_id'] not in self.kernels:
+            return FakeResponse(404)
+        return FakeResponse(101, body=match_info['kernel_id'])
+
+    def execute(self, kernel_id, request_msg):
+        """
+        Run request_msg on kernel_id, returning the messages it sends in reply.
+
+        Replies are split in those sent before execute_time passes & after.
+        Returns None if the kernel doesn't exist.
+        """
+        start = time.process_time()
+        try:
+            if kernel_id not in self.kernels:
+                return None
+            code = request_msg['content']['code']
+            parent_header = request_msg['header']
+
+            def reply(channel, msg_type, content):
+                return {
+                    'channel': channel,
+                    'msg_type': msg_type,
+                    'parent_header': parent_header,
+                    'content': content,
+                }
+
+            self.counts['execute'] += 1
+            started = [
+                reply('iopub', 'status', {'execution_state': 'busy'}),
+                reply('iopub', 'execute_input', {'code': code}),
+            ]
+            if code in self.outputs:
+                finished = [
+                    reply(
+                        'iopub',
+                        'execute_result',
+                        {'data': {'text/plain': self.outputs[code]}},
+                    )
+                ]
+                status = 'ok'
+            else:
+                finished = [reply('iopub', 'error', {'ename': 'NameError'})]
+                status = 'error'
+            finished += [
+                reply('iopub', 'status', {'execution_state': 'idle'}),
+                reply('shell', 'execute_reply', {'status': status}),
+            ]
+            return started, finished
+        finally:
+            self.cpu += time.process_time() - start
+
+
+async def run(args, hub):
+    """
+    Simulate args.user_count users against hub, returning a Counter of outcomes
+    """
+    simulate_args = argparse.Namespace(
+        # Never resolved, requests go straight to hub
+        hub_url='http://fakehub',
+        user_count=args.user_count,
+        user_prefix='user',
+        user_session_min_runtime=args.user_session_min_runtime,
+        user_session_max_runtime=args.user_session_max_runtime,
+        user_session_max_start_delay=args.user_session_max_start_delay,
+        execute_mode=args.execute_mode,
+        execute_rate=args.execute_rate,
+        # The fake kernel only knows the default cell
+        workload=[],
+        credential_store=None,
+        auth='dummy',
+        replay=None,
+        # Our own CPU & lag don't mean anything in virtual time
+        monitor_interval=0,
+        trace_requests=False,
+        run_deadline=None,
+        teardown_concurrency=args.teardown_concurrency,
+        teardown_retries=args.teardown_retries,
+        teardown_deadline=120,
+    )
+    return await simulate.run(
+        simulate_args,
+        clock=asyncio.get_running_loop().time,
+        session_factory=partial(FakeSession, hub),
+    )
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('user_count', type=int, help='Number of users to simulate')
+    argparser.add_argument(
+        '--seed', default=0, type=int, help='Seed for all random choices'
+    )
+    argparser.add_argument(
+        '--user-session-min-runtime',
+        default=60,
+        type=int,
+        help='Min seconds user is active for',
+    )
+    argparser.add_argument(
+        '--user-session-max-runtime',
+        default=300,
+        type=int,
+        help='Max seconds user is active for',
+    )
+    argparser.add_argument(
+        '--user-session-max-start-delay',
+        default=60,
+        type=int,
+        help='Max seconds by which all users should have logged in',
+    )
+    add_execute_arguments(argparser)
+    add_teardown_arguments(argparser)
+    argparser.add_argument(
+        '--spawn-time',
+        default=10,
+        type=float,
+        help='Seconds the fake hub takes to start a server',
+    )
+    argparser.add_argument(
+        '--spawn-failure-rate',
+        default=0,
+        type=float,
+        help='Fraction of spawns that fail on the fake hub',
+    )
+    argparser.add_argument(
+        '--concurrent-spawn-limit',
+        type=int,
+        help='Max pending spawns on the fake hub before new ones are rejected',
+    )
+    argparser.add_argument(
+        '--stop-failure-rate',
+        default=0,
+        type=float,
+        help='Fraction of server stops that fail on the fake hub',
+    )
+    argparser.add_argument(
+        '--execute-time',
+        default=0.01,
+        type=float,
+        help='Seconds the fake kernel takes for each execution',
+    )
+    argparser.add_argument(
+        '--verbose', action='store_true', help='Print what every user does'
+    )
+    args = argparser.parse_args()
+
+    check_execute_arguments(argparser, args)
+
+    hub = FakeHub(
+        spawn_time=args.spawn_time,
+        spawn_failure_rate=args.spawn_failure_rate,
+        concurrent_spawn_limit=args.concurrent_spawn_limit,
+        stop_failure_rate=args.stop_failure_rate,
+        execute_time=args.execute_time,
+        seed=args.seed,
+    )
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    with contextlib.ExitStack() as stack:
+        if not args.verbose:
+            devnull = stack.enter_context(open(os.devnull, 'w'))
+            stack.enter_context(contextlib.redirect_stdout(devnull))
+        loop_time = []
+
+        async def timed_run():
+            outcomes = await run(args, hub)
+            loop_time.append(asyncio.get_running_loop().time())
+            return outcomes
+
+        outcomes = run_virtual(timed_run(), args.seed)
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+
+    print(
+        f'Simulated {args.user_count} users over {loop_time[0]:.0f} virtual seconds '
+        f'in {wall:.1f}s'
+    )
+    executions = max(hub.counts['execute'], 1)
+    for name, seconds in [('Simulator', cpu - hub.cpu), ('Fake hub', hub.cpu)]:
+        print(
+            f'{name} CPU: {seconds:.2f}s, '
+            f'{1000 * seconds / args.user_count:.3f}ms per user, '
+            f'{1000 * seconds / executions:.3f}ms per execution'
+        )
+    print('Outcomes:', dict(outcomes))
+    print('Fake hub:', dict(hub.counts))
+
+
+if __name__ == '__main__':
+    main()
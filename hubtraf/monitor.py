@@ -0,0 +1,141 @@
+"""
+Monitor whether hubtraf itself is saturated while generating load.
+
+If our own event loop falls behind, every duration we measure is inflated.
+SaturationMonitor samples the state of this process at a fixed interval and
+emits it as events alongside the normal ones, so analysis can tell hub
+slowness from client slowness.
+"""
+
+import asyncio
+import os
+import resource
+import time
+
+import structlog
+
+logger = structlog.get_logger()
+
+
+def rss_bytes():
+    """
+    Return resident set size of this process in bytes
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # Not on linux. This is peak, not current, RSS (in KiB on linux, bytes on macOS)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def open_sockets():
+    """
+    Return number of sockets open in this process, or None if unknown
+    """
+    try:
+        fds = os.listdir('/proc/self/fd')
+    except OSError:
+        return None
+    count = 0
+    for fd in fds:
+        try:
+            if os.readlink(f'/proc/self/fd/{fd}').startswith('socket:'):
+                count += 1
+        except OSError:
+            # fd was closed while we were looking
+            continue
+    return count
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+class SaturationMonitor:
+    """
+    Sample event loop lag, CPU, RSS, open sockets & pending tasks every interval.
+
+    Each sample is emitted as a 'client-monitor' event. The process is
+    considered saturated when the event loop lags by more than max_lag seconds,
+    or CPU usage is over max_cpu percent. Windows of saturation are emitted as
+    'client-saturated' start & complete events, so they can be counted like
+    any other in-progress action, and are kept in saturated_windows as
+    (start, end) time.monotonic() tuples.
+    """
+
+    def __init__(self, interval=1, max_lag=0.1, max_cpu=90):
+        self.interval = interval
+        self.max_lag = max_lag
+        self.max_cpu = max_cpu
+        self.log = logger.bind(action='client-monitor')
+        self.saturated_since = None
+        self.saturated_windows = []
+        self.task = None
+
+    async def __aenter__(self):
+        self.task = asyncio.ensure_future(self.run())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        if self.saturated_since is not None:
+            self.set_saturated(False, time.monotonic())
+
+    def saturated_during(self, start, end):
+        """
+        Return True if we were saturated at any point between start and end
+        """
+        windows = list(self.saturated_windows)
+        if self.saturated_since is not None:
+            windows.append((self.saturated_since, time.monotonic()))
+        return any(s < end and e > start for s, e in windows)
+
+    def set_saturated(self, saturated, now):
+        if saturated:
+            self.saturated_since = now
+            self.log.msg(
+                'Load generator saturated', action='client-saturated', phase='start'
+            )
+        else:
+            self.saturated_windows.append((self.saturated_since, now))
+            self.log.msg(
+                'Load generator no longer saturated',
+                action='client-saturated',
+                phase='complete',
+                duration=now - self.saturated_since,
+            )
+            self.saturated_since = None
+
+    async def run(self):
+        last_time = time.monotonic()
+        last_cpu = cpu_seconds()
+        while True:
+            sleep_start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            cpu = cpu_seconds()
+            lag = now - sleep_start - self.interval
+            cpu_percent = 100 * (cpu - last_cpu) / (now - last_time)
+            window_start = last_time
+            last_time, last_cpu = now, cpu
+
+            saturated = lag > self.max_lag or cpu_percent > self.max_cpu
+            self.log.msg(
+                'Load generator sample',
+                phase='sample',
+                lag=lag,
+                cpu_percent=cpu_percent,
+                rss=rss_bytes(),
+                sockets=open_sockets(),
+                tasks=len(asyncio.all_tasks()),
+                saturated=saturated,
+            )
+            if saturated != (self.saturated_since is not None):
+                # Saturation started sometime during the last interval
+                self.set_saturated(saturated, window_start if saturated else now)
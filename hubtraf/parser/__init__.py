@@ -7,6 +7,9 @@ import json
 
 from dateutil import parser
 
+from hubtraf.parser.compression import is_compressed, open_log
+from hubtraf.parser.index import OffsetIndex, index_path
+
 
 def extract_event(line):
     r"""
@@ -32,17 +35,25 @@ def extract_event(line):
     return processed_data
 
 
-def prepare_data(inputpath, outputpath):
+def prepare_data(inputpath, outputpath, index=False):
     """
     Process raw logs from fluentd into a form that can be used for processing.
 
     1. Parses the JSON output from fluent-bit logs
     2. Sorts them by time so we can do easier stream analyzis on it.
+    3. If index is True, writes a sidecar index next to outputpath, for use
+       with hubtraf-lookup
+
+    inputpath & outputpath may be gzip or zstd compressed, see open_log.
+    Compressed output can't be indexed.
 
     The sorting loads the whole dataset into memory, so do not pass it too big files!
     """
+    if index and is_compressed(outputpath):
+        raise ValueError(f'Can not index compressed output {outputpath}')
+
     events = []
-    with open(inputpath) as inputfile:
+    with open_log(inputpath) as inputfile:
         for l in inputfile:
             try:
                 events.append(extract_event(l))
@@ -52,9 +63,18 @@ def prepare_data(inputpath, outputpath):
 
     events.sort(key=lambda e: parser.parse(e['timestamp']))
 
-    with open(outputpath, 'w') as outputfile:
+    offset_index = OffsetIndex() if index else None
+    offset = 0
+    with open_log(outputpath, 'wb') as outputfile:
         for e in events:
-            outputfile.write(json.dumps(e) + '\n')
+            line = (json.dumps(e) + '\n').encode()
+            outputfile.write(line)
+            if offset_index is not None:
+                offset_index.add(e, offset)
+            offset += len(line)
+
+    if offset_index is not None:
+        offset_index.save(index_path(outputpath))
 
 
 def main():
@@ -64,10 +84,15 @@ def main():
     argparser = argparse.ArgumentParser()
     argparser.add_argument('inputpath')
     argparser.add_argument('outputpath')
+    argparser.add_argument(
+        '--index',
+        action='store_true',
+        help='Write a sidecar index of users & actions, for use with hubtraf-lookup',
+    )
 
     args = argparser.parse_args()
 
-    prepare_data(args.inputpath, args.outputpath)
+    prepare_data(args.inputpath, args.outputpath, args.index)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,125 @@
+"""
+Transparently read & write gzip or zstd compressed logs.
+
+Compression is picked by file extension: .gz for gzip, .zst or .zstd for
+zstd (needs the 'zstd' extra). Anything else is read & written as is.
+"""
+
+import gzip
+import io
+import queue
+import threading
+
+GZIP_EXTENSIONS = ('.gz',)
+ZSTD_EXTENSIONS = ('.zst', '.zstd')
+
+
+def is_compressed(path):
+    return str(path).endswith(GZIP_EXTENSIONS + ZSTD_EXTENSIONS)
+
+
+class ThreadedReader(io.RawIOBase):
+    """
+    Read from a (decompressing) binary stream in a background thread.
+
+    Both zlib & zstd release the GIL while decompressing, so this lets
+    decompression of the next chunks happen while the current one is being
+    parsed. At most queue_size chunks are kept in memory.
+    """
+
+    def __init__(self, raw, chunk_size=1024 * 1024, queue_size=4):
+        self.raw = raw
+        self.chunk_size = chunk_size
+        self.queue = queue.Queue(queue_size)
+        self.stopped = threading.Event()
+        self.current = memoryview(b'')
+        self.eof = False
+        self.thread = threading.Thread(target=self.fill, daemon=True)
+        self.thread.start()
+
+    def fill(self):
+        try:
+            while not self.stopped.is_set():
+                chunk = self.raw.read(self.chunk_size)
+                self.put(chunk)
+                if not chunk:
+                    return
+        except Exception as e:
+            self.put(e)
+
+    def put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if not self.current:
+            if self.eof:
+                return 0
+            item = self.queue.get()
+            if isinstance(item, Exception):
+                raise item
+            if not item:
+                self.eof = True
+                return 0
+            self.current = memoryview(item)
+        size = min(len(b), len(self.current))
+        b[:size] = self.current[:size]
+        self.current = self.current[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.stopped.set()
+            self.thread.join()
+            self.raw.close()
+        super().close()
+
+
+def _open_zstd(path, mode, threads):
+    import zstandard
+
+    if mode == 'rb':
+        # Logs appended to over time are made of many zstd frames
+        return zstandard.ZstdDecompressor().stream_reader(
+            open(path, 'rb'), read_across_frames=True, closefd=True
+        )
+    # threads=-1 compresses with one thread per CPU
+    return zstandard.ZstdCompressor(threads=threads).stream_writer(
+        open(path, 'wb'), closefd=True
+    )
+
+
+def open_log(path, mode='r', threads=-1):
+    """
+    Open a possibly compressed log at path, in mode 'r', 'rb', 'w' or 'wb'.
+
+    Compressed logs are decompressed in a background thread when reading,
+    and compressed with up to threads threads (-1 for one per CPU) when
+    writing zstd. Text modes are always utf-8.
+    """
+    binary_mode = mode if mode.endswith('b') else mode + 'b'
+    if binary_mode not in ('rb', 'wb'):
+        raise ValueError(f'Unsupported mode {mode}')
+    path = str(path)
+
+    if path.endswith(GZIP_EXTENSIONS):
+        f = gzip.open(path, binary_mode, compresslevel=6)
+    elif path.endswith(ZSTD_EXTENSIONS):
+        f = _open_zstd(path, binary_mode, threads)
+    else:
+        if mode.endswith('b'):
+            return open(path, mode)
+        return open(path, mode, encoding='utf-8')
+
+    if binary_mode == 'rb':
+        f = io.BufferedReader(ThreadedReader(f))
+    if mode.endswith('b'):
+        return f
+    return io.TextIOWrapper(f, encoding='utf-8')
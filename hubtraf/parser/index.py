@@ -0,0 +1,271 @@
+"""
+Sidecar index over processed hubtraf logs, for instant lookups.
+
+The index maps each username to the byte offsets of their events, and each
+action to the time range it was seen in & the offsets of its failures. With
+it, one user's timeline - or all failures of one action - can be read from a
+multi-GB log without scanning it.
+
+The index is a compact binary file, read with mmap, so a lookup only touches
+the few pages it needs instead of parsing the whole index. It is laid out as:
+
+    magic (8 bytes)
+    length of metadata (uint64), metadata as JSON
+    users table
+    failures table
+
+Metadata is {action: {'start', 'end', 'failures'}}, with the time range &
+failure count of each action. Each table maps keys (usernames, actions) to
+offsets:
+
+    key count, key bytes length, offset count (3 x uint64)
+    one entry per key, sorted by key: key start, key length, offsets start,
+        offset count (4 x uint64)
+    UTF-8 encoded keys, concatenated
+    offsets (uint64 each)
+
+All integers are little endian.
+"""
+
+import argparse
+import bisect
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+from hubtraf.analysis.accumulators import is_failure
+
+MAGIC = b'HTINDEX1'
+TABLE_HEADER = struct.Struct('<QQQ')
+TABLE_ENTRY = struct.Struct('<QQQQ')
+OFFSET = struct.Struct('<Q')
+
+
+def index_path(logpath):
+    return f'{logpath}.index'
+
+
+def _write_table(f, table):
+    keys = sorted((key.encode(), offsets) for key, offsets in table.items())
+    entries = []
+    key_start = offsets_start = 0
+    for key, offsets in keys:
+        entries.append(
+            TABLE_ENTRY.pack(key_start, len(key), offsets_start, len(offsets))
+        )
+        key_start += len(key)
+        offsets_start += len(offsets)
+    f.write(TABLE_HEADER.pack(len(keys), key_start, offsets_start))
+    f.write(b''.join(entries))
+    f.write(b''.join(key for key, _ in keys))
+    for _, offsets in keys:
+        offsets = array('Q', offsets)
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+        f.write(offsets.tobytes())
+
+
+class OffsetIndex:
+    """
+    Build an index of a processed log as it is written
+    """
+
+    def __init__(self):
+        self.users = {}
+        self.actions = {}
+        self.failures = {}
+
+    def add(self, event, offset):
+        """
+        Add event, written at byte offset of the log
+        """
+        username = event.get('username')
+        if username is not None:
+            if username not in self.users:
+                self.users[username] = array('Q')
+            self.users[username].append(offset)
+
+        action = event.get('action')
+        if action is not None:
+            timestamp = event.get('timestamp')
+            if action not in self.actions:
+                self.actions[action] = {
+                    'start': timestamp,
+                    'end': timestamp,
+                    'failures': 0,
+                }
+                self.failures[action] = array('Q')
+            info = self.actions[action]
+            if timestamp is not None:
+                if info['start'] is None or timestamp < info['start']:
+                    info['start'] = timestamp
+                if info['end'] is None or timestamp > info['end']:
+                    info['end'] = timestamp
+            if is_failure(event.get('phase') or ''):
+                info['failures'] += 1
+                self.failures[action].append(offset)
+
+    def save(self, path):
+        metadata = json.dumps(self.actions).encode()
+        with open(path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(OFFSET.pack(len(metadata)))
+            f.write(metadata)
+            _write_table(f, self.users)
+            _write_table(f, self.failures)
+
+
+class _Table:
+    """
+    Keys & offsets of one table of an index, looked up in place
+    """
+
+    def __init__(self, buffer, start):
+        self.buffer = buffer
+        self.count, key_bytes, offset_count = TABLE_HEADER.unpack_from(buffer, start)
+        self.entries_start = start + TABLE_HEADER.size
+        self.keys_start = self.entries_start + self.count * TABLE_ENTRY.size
+        self.offsets_start = self.keys_start + key_bytes
+        self.end = self.offsets_start + offset_count * OFFSET.size
+
+    def entry(self, i):
+        return TABLE_ENTRY.unpack_from(
+            self.buffer, self.entries_start + i * TABLE_ENTRY.size
+        )
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        # Sorted keys, so the table can be searched with bisect
+        key_start, key_length, _, _ = self.entry(i)
+        start = self.keys_start + key_start
+        return self.buffer[start : start + key_length]
+
+    def offsets(self, key):
+        key = key.encode()
+        i = bisect.bisect_left(self, key)
+        if i == len(self) or self[i] != key:
+            return []
+        _, _, start, count = self.entry(i)
+        return list(
+            struct.unpack_from(
+                f'<{count}Q', self.buffer, self.offsets_start + start * OFFSET.size
+            )
+        )
+
+
+class SidecarIndex:
+    """
+    An index written by OffsetIndex, memory mapped for lookups.
+
+    Use as a context manager, or call close when done.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[: len(MAGIC)] != MAGIC:
+            self.mm.close()
+            raise ValueError(f'{path} is not a hubtraf index')
+        (metadata_length,) = OFFSET.unpack_from(self.mm, len(MAGIC))
+        metadata_start = len(MAGIC) + OFFSET.size
+        self.actions = json.loads(
+            self.mm[metadata_start : metadata_start + metadata_length]
+        )
+        self.users = _Table(self.mm, metadata_start + metadata_length)
+        self.failures = _Table(self.mm, self.users.end)
+
+    def user_offsets(self, username):
+        return self.users.offsets(username)
+
+    def failure_offsets(self, action):
+        return self.failures.offsets(action)
+
+    def close(self):
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_events(logpath, offsets):
+    """
+    Return events found at each of offsets in logpath
+    """
+    events = []
+    with open(logpath, 'rb') as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        for offset in offsets:
+            end = mm.find(b'\n', offset)
+            if end == -1:
+                end = len(mm)
+            events.append(json.loads(mm[offset:end]))
+    return events
+
+
+def load_index(logpath):
+    return SidecarIndex(index_path(logpath))
+
+
+def user_timeline(logpath, username, index=None):
+    """
+    Return all events of username in logpath, in order
+    """
+    if index is None:
+        with load_index(logpath) as index:
+            return user_timeline(logpath, username, index)
+    return read_events(logpath, index.user_offsets(username))
+
+
+def action_failures(logpath, action, index=None):
+    """
+    Return all failure events of action in logpath, in order
+    """
+    if index is None:
+        with load_index(logpath) as index:
+            return action_failures(logpath, action, index)
+    return read_events(logpath, index.failure_offsets(action))
+
+
+def main():
+    """
+    Command line utility to look up events in an indexed, processed log
+    """
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('logpath', help='Processed log, indexed with --index')
+    group = argparser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--user', help='Print all events of this user')
+    group.add_argument('--failures', help='Print all failures of this action')
+    group.add_argument(
+        '--actions',
+        action='store_true',
+        help='Print time range & failure count of each action',
+    )
+    args = argparser.parse_args()
+
+    if args.actions:
+        with load_index(args.logpath) as index:
+            for action, info in index.actions.items():
+                print(
+                    f'{action} {info["start"]} - {info["end"]} '
+                    f'failures:{info["failures"]}'
+                )
+        return
+
+    if args.user:
+        events = user_timeline(args.logpath, args.user)
+    else:
+        events = action_failures(args.logpath, args.failures)
+    for event in events:
+        print(json.dumps(event))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Shared polling of server status for many users through the hub API
+"""
+
+import asyncio
+
+import aiohttp
+from yarl import URL
+
+
+class ServerStatusPoller:
+    """
+    Wait for many users' servers to become ready with one batched poll.
+
+    Instead of every user polling /hub/api/users/<name>, one task lists all
+    users with active servers every `interval` seconds, page by page, and
+    resolves the waiting users whose servers are ready. The number of requests
+    per interval depends on the number of active servers / page_size, not on
+    the number of users waiting.
+
+    Polling only runs while someone is waiting.
+    """
+
+    def __init__(self, hub_url, api_token, interval=0.5, page_size=200):
+        self.api_url = URL(hub_url) / 'hub/api'
+        self.headers = {
+            'Authorization': f'token {api_token}',
+            # Ask for paginated responses. Hubs older than 2.0 ignore this and
+            # return all users in one list.
+            'Accept': 'application/jupyterhub-pagination+json',
+        }
+        self.interval = interval
+        self.page_size = page_size
+        # username -> future resolved when their server is ready
+        self.waiters = {}
+        self.poll_task = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self.poll_task is not None:
+            self.poll_task.cancel()
+        await self.session.close()
+
+    async def fetch_ready_users(self):
+        """
+        Return set of usernames whose default server is ready
+        """
+        ready = set()
+        offset = 0
+        while True:
+            async with self.session.get(
+                self.api_url / 'users',
+                params={'state': 'active', 'offset': offset, 'limit': self.page_size},
+                headers=self.headers,
+            ) as resp:
+                resp.raise_for_status()
+                body = await resp.json()
+            if isinstance(body, list):
+                users, next_page = body, None
+            else:
+                users, next_page = body['items'], body['_pagination']['next']
+            for user in users:
+                if user.get('servers', {}).get('', {}).get('ready'):
+                    ready.add(user['name'])
+            if not next_page:
+                return ready
+            offset = next_page['offset']
+
+    async def poll(self):
+        while self.waiters:
+            try:
+                ready = await self.fetch_ready_users()
+            except Exception as e:
+                print(f'Polling server status failed: {e!r}')
+            else:
+                for username in ready & self.waiters.keys():
+                    future = self.waiters.pop(username)
+                    if not future.done():
+                        future.set_result(True)
+            await asyncio.sleep(self.interval)
+        self.poll_task = None
+
+    async def wait_until_ready(self, username):
+        """
+        Wait until username's default server is ready.
+
+        There is no timeout here, wrap it in asyncio.wait_for if needed.
+        """
+        if username not in self.waiters:
+            self.waiters[username] = asyncio.get_running_loop().create_future()
+        future = self.waiters[username]
+        if self.poll_task is None:
+            self.poll_task = asyncio.ensure_future(self.poll())
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if not future.done():
+                # We were cancelled, no one is waiting for this user anymore
+                future.cancel()
+                self.waiters.pop(username, None)
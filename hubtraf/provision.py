@@ -0,0 +1,149 @@
+"""
+Log users in or mint API tokens for them ahead of a run.
+
+Credentials are saved to a local directory, and can be used by later runs
+with hubtraf.auth.store.login_from_store so they skip the login page.
+"""
+
+import argparse
+import asyncio
+import os
+from collections import Counter
+
+import aiohttp
+import structlog
+from yarl import URL
+
+from hubtraf.auth.dummy import login_dummy
+from hubtraf.auth.store import cookies_path, token_path
+from hubtraf.check import expand_usernames
+
+logger = structlog.get_logger()
+
+
+async def provision_user_cookies(connector, hub_url, username, password, store_dir):
+    """
+    Log username in with the dummy authenticator and save their cookie jar
+    """
+    async with aiohttp.ClientSession(
+        connector=connector, connector_owner=False
+    ) as session:
+        logged_in = await login_dummy(
+            session=session,
+            hub_url=hub_url,
+            log=logger.bind(username=username),
+            username=username,
+            password=password,
+        )
+        if not logged_in:
+            return 'failed'
+        session.cookie_jar.save(cookies_path(store_dir, username))
+        return 'provisioned'
+
+
+async def provision_user_token(session, hub_url, username, store_dir, note='hubtraf'):
+    """
+    Create username if needed, mint an API token for them & save it.
+
+    session must be authenticated with an admin API token.
+    """
+    api_url = hub_url / 'hub/api/users' / username
+    try:
+        async with session.post(api_url) as resp:
+            # 409 means user already exists
+            if resp.status not in (201, 409):
+                print(f'Creating user {username} failed: {resp}')
+                return 'failed'
+        async with session.post(api_url / 'tokens', json={'note': note}) as resp:
+            if resp.status != 201:
+                print(f'Creating token for {username} failed: {resp}')
+                return 'failed'
+            token = (await resp.json())['token']
+    except Exception as e:
+        print(f'Provisioning {username} failed: {e!r}')
+        return 'failed'
+    with open(
+        token_path(store_dir, username),
+        'w',
+        opener=lambda path, flags: os.open(path, flags, 0o600),
+    ) as f:
+        f.write(token)
+    return 'provisioned'
+
+
+async def provision(
+    hub_url, usernames, store_dir, password=None, api_token=None, concurrency=50
+):
+    """
+    Provision credentials for all usernames, at most concurrency at a time.
+
+    If api_token is set, API tokens are minted with it. Otherwise users are
+    logged in with password, and their cookie jars are saved.
+    """
+    hub_url = URL(hub_url)
+    os.makedirs(store_dir, exist_ok=True)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with aiohttp.ClientSession(
+        headers={'Authorization': f'token {api_token}'} if api_token else None,
+    ) as session:
+
+        async def provision_one(username):
+            async with semaphore:
+                if api_token:
+                    return await provision_user_token(
+                        session, hub_url, username, store_dir
+                    )
+                return await provision_user_cookies(
+                    session.connector, hub_url, username, password, store_dir
+                )
+
+        results = await asyncio.gather(*[provision_one(u) for u in usernames])
+    return dict(zip(usernames, results))
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument(
+        'hub_url', help='Hub URL to provision users on (without a trailing /)'
+    )
+    argparser.add_argument('store_dir', help='Directory to save credentials in')
+    argparser.add_argument(
+        'usernames',
+        nargs='+',
+        help='Names of users to provision. {start..end} ranges are expanded, eg. user-{1..100}',
+    )
+    argparser.add_argument(
+        '--password', default='hello', help='Password to log users in with'
+    )
+    argparser.add_argument(
+        '--tokens',
+        action='store_true',
+        help='Mint API tokens using the admin token in JUPYTERHUB_API_TOKEN, instead of logging in',
+    )
+    argparser.add_argument(
+        '--concurrency',
+        default=50,
+        type=int,
+        help='Max number of users to provision at the same time',
+    )
+    args = argparser.parse_args()
+
+    api_token = os.environ['JUPYTERHUB_API_TOKEN'] if args.tokens else None
+
+    loop = asyncio.get_event_loop()
+    results = loop.run_until_complete(
+        provision(
+            args.hub_url,
+            expand_usernames(args.usernames),
+            args.store_dir,
+            args.password,
+            api_token,
+            args.concurrency,
+        )
+    )
+    print(Counter(results.values()))
+
+
+if __name__ == '__main__':
+    main()
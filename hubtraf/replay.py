@@ -0,0 +1,103 @@
+"""
+Rebuild user arrival times & session lengths from a recorded event log
+"""
+
+import heapq
+import json
+from collections import OrderedDict
+from datetime import datetime
+
+from hubtraf.parser.compression import open_log
+
+
+def parse_timestamp(timestamp):
+    """
+    Return seconds since the epoch of an ISO 8601 timestamp, as hubtraf logs them
+
+    >>> parse_timestamp('2018-03-09T04:49:40.336049Z')
+    1520570980.336049
+    """
+    if timestamp.endswith('Z'):
+        # Only understood by fromisoformat from Python 3.11
+        timestamp = timestamp[:-1] + '+00:00'
+    return datetime.fromisoformat(timestamp).timestamp()
+
+
+def replay_schedule(logfile, time_compression=1, idle_timeout=3600):
+    """
+    Stream (username, arrival, session_length) from a processed log.
+
+    arrival is seconds since the first user in the log arrived, and both
+    arrival & session_length are divided by time_compression. Sessions are
+    yielded in order of arrival.
+
+    A user's session starts with their first event, and ends with a
+    successful server-stop or once they have been idle for idle_timeout
+    seconds. The log must be sorted by time, as prepare_data does. Only
+    sessions that are still open - or finished but waiting for an earlier
+    session to finish - are kept in memory, so arbitrarily long logs can be
+    replayed. logfile may be gzip or zstd compressed.
+    """
+    # username -> [arrival, last seen], in order of arrival
+    open_sessions = OrderedDict()
+    # username -> None, in order of last activity
+    by_activity = OrderedDict()
+    # (arrival, counter, username, length) of sessions that have ended
+    finished = []
+    counter = 0
+    first_arrival = None
+
+    def close(username):
+        nonlocal counter
+        arrival, last_seen = open_sessions.pop(username)
+        del by_activity[username]
+        heapq.heappush(finished, (arrival, counter, username, last_seen - arrival))
+        counter += 1
+
+    def ready():
+        # Sessions can be yielded once no open session arrived before them
+        while finished and (
+            not open_sessions or finished[0][0] <= next(iter(open_sessions.values()))[0]
+        ):
+            arrival, _, username, length = heapq.heappop(finished)
+            yield (
+                username,
+                (arrival - first_arrival) / time_compression,
+                length / time_compression,
+            )
+
+    with open_log(logfile) as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+                username = event['username']
+                timestamp = parse_timestamp(event['timestamp'])
+            except (ValueError, KeyError):
+                continue
+            if first_arrival is None:
+                first_arrival = timestamp
+
+            # Close sessions that have been idle for too long
+            while by_activity:
+                idle_username = next(iter(by_activity))
+                if timestamp - open_sessions[idle_username][1] <= idle_timeout:
+                    break
+                close(idle_username)
+
+            if username in open_sessions:
+                open_sessions[username][1] = timestamp
+                by_activity.move_to_end(username)
+            else:
+                open_sessions[username] = [timestamp, timestamp]
+                by_activity[username] = None
+
+            if (
+                event.get('action') == 'server-stop'
+                and event.get('phase') == 'complete'
+            ):
+                close(username)
+            yield from ready()
+
+    while open_sessions:
+        close(next(iter(open_sessions)))
+    yield from ready()
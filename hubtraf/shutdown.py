@@ -0,0 +1,102 @@
+"""
+Tear down kernels & servers of many simulated users quickly
+"""
+
+import asyncio
+import time
+
+from hubtraf.user import User
+
+
+def has_server(user):
+    """
+    Return True if user has a server running, or may have one starting
+    """
+    return user.spawn_requested or user.state in (
+        User.States.SERVER_STARTED,
+        User.States.KERNEL_STARTED,
+    )
+
+
+class ShutdownManager:
+    """
+    Keep track of users with running servers, and tear them all down.
+
+    Users register themselves once they have entered their session, and call
+    teardown_user when they are done - either normally, or because their task
+    was cancelled on interrupt or when the run deadline passed. At most
+    `concurrency` users are torn down at the same time, and failed stops are
+    retried `retries` times with exponential backoff.
+    """
+
+    def __init__(self, concurrency=50, retries=3):
+        self.concurrency = concurrency
+        self.retries = retries
+        self.users = set()
+        self.torn_down = 0
+        self.semaphore = None
+
+    def register(self, user):
+        self.users.add(user)
+
+    def leftovers(self):
+        """
+        Return usernames whose kernel or server are still running
+        """
+        return sorted(u.username for u in self.users if has_server(u))
+
+    async def teardown_user(self, user):
+        """
+        Stop user's kernel & server, if they are running or were requested.
+
+        Returns True if nothing is left running.
+        """
+        if not has_server(user):
+            self.users.discard(user)
+            return True
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        async with self.semaphore:
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    await asyncio.sleep(2 ** (attempt - 1))
+                if user.state == User.States.KERNEL_STARTED:
+                    # If this fails, stopping the server stops the kernel too
+                    await user.stop_kernel()
+                await user.stop_server()
+                if not has_server(user):
+                    self.users.discard(user)
+                    self.torn_down += 1
+                    return True
+        return False
+
+    async def shutdown(self, tasks, deadline=120):
+        """
+        Cancel all tasks, and wait at most deadline seconds for them to tear down.
+
+        Cancelled tasks are expected to call teardown_user as they unwind.
+        Prints a report of teardown throughput & users left running.
+        """
+        start_time = time.monotonic()
+        torn_down_before = self.torn_down
+        pending = set()
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=deadline)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+        duration = time.monotonic() - start_time
+
+        torn_down = self.torn_down - torn_down_before
+        leftovers = self.leftovers()
+        print(
+            f'Teardown: {torn_down} users torn down in {duration:.1f}s '
+            f'({torn_down / duration if duration else 0:.1f} users/s), '
+            f'{len(leftovers)} left running'
+        )
+        if leftovers:
+            print('Left running:', ' '.join(leftovers))
+        return leftovers
@@ -1,46 +1,127 @@
 import argparse
 import asyncio
+import contextlib
+import itertools
+import os
 import random
+import signal
 import socket
+import threading
+import time
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from functools import partial
 
-import structlog
-
 from hubtraf.auth.dummy import login_dummy
+from hubtraf.auth.lti import login_lti, sign_launch_batch, sign_launches
+from hubtraf.auth.store import login_from_store
+from hubtraf.cli import (
+    add_execute_arguments,
+    add_monitor_arguments,
+    add_teardown_arguments,
+    check_execute_arguments,
+    configure_structlog,
+    get_execute_mode,
+)
+from hubtraf.monitor import SaturationMonitor
+from hubtraf.replay import replay_schedule
+from hubtraf.shutdown import ShutdownManager
+from hubtraf.tracing import RequestTracer
 from hubtraf.user import User
+from hubtraf.workloads import choose_cell, parse_workload
+
+# Launches of a streamed schedule signed per worker process task
+LTI_SIGNING_BATCH_SIZE = 256
 
 
 async def simulate_user(
-    hub_url, username, password, delay_seconds, code_execute_seconds
+    hub_url,
+    username,
+    password,
+    delay_seconds,
+    code_execute_seconds,
+    execute_mode=None,
+    execute_rate=None,
+    credential_store=None,
+    login_handler=None,
+    shutdown=None,
+    tracer=None,
+    connector=None,
+    cell=None,
+    clock=time.monotonic,
+    session_factory=None,
 ):
     await asyncio.sleep(delay_seconds)
-    async with User(username, hub_url, partial(login_dummy, password=password)) as u:
-        try:
-            if not await u.login():
-                return 'login'
-            if not await u.ensure_server_simulate():
-                return 'start-server'
-            if not await u.start_kernel():
-                return 'start-kernel'
-            if not await u.assert_code_output("5 * 4", "20", 5, code_execute_seconds):
-                return 'run-code'
-            return 'completed'
-        finally:
-            if u.state == User.States.KERNEL_STARTED:
-                await u.stop_kernel()
-                await u.stop_server()
+    if login_handler is None:
+        if credential_store:
+            login_handler = partial(login_from_store, store_dir=credential_store)
+        else:
+            login_handler = partial(login_dummy, password=password)
+    async with User(
+        username,
+        hub_url,
+        login_handler,
+        connector=connector,
+        tracer=tracer,
+        clock=clock,
+        session_factory=session_factory,
+    ) as u:
+        return await user_session(
+            u, code_execute_seconds, execute_mode, execute_rate, shutdown, cell
+        )
 
 
-async def run(args):
-    # FIXME: Pass in individual arguments, not argparse object
-    awaits = []
+async def user_session(
+    u,
+    code_execute_seconds,
+    execute_mode=None,
+    execute_rate=None,
+    shutdown=None,
+    cell=None,
+):
+    """
+    Run one session for User u: log in, start a server & kernel, run code, stop.
+
+    cell is the (code, output) to run, see hubtraf.workloads. It defaults to
+    a trivial calculation. Users who are already logged in, eg. because u
+    was used for a previous session, don't log in again. Returns 'completed',
+    or the stage that failed.
+    """
+    if cell is None:
+        cell = ("5 * 4", "20")
+    if shutdown is None:
+        shutdown = ShutdownManager()
+    shutdown.register(u)
+    try:
+        if u.state == User.States.CLEAR and not await u.login():
+            return 'login'
+        if not await u.ensure_server_simulate():
+            return 'start-server'
+        if not await u.start_kernel():
+            return 'start-kernel'
+        if not await u.assert_code_output(
+            *cell,
+            5,
+            code_execute_seconds,
+            mode=execute_mode,
+            rate=execute_rate,
+        ):
+            return 'run-code'
+        return 'completed'
+    finally:
+        # Runs when we are cancelled too, so servers don't leak on interrupt
+        await shutdown.teardown_user(u)
+
+
+def random_schedule(args):
+    """
+    Return (username, delay, runtime) for each user, uniformly distributed
+    """
+    schedule = []
     for i in range(args.user_count):
-        awaits.append(
-            simulate_user(
-                args.hub_url,
+        schedule.append(
+            (
                 f'{args.user_prefix}-' + str(i),
-                'hello',
                 int(random.uniform(0, args.user_session_max_start_delay)),
                 int(
                     random.uniform(
@@ -49,9 +130,189 @@ async def run(args):
                 ),
             )
         )
+    schedule.sort(key=lambda s: s[1])
+    return schedule
+
+
+async def with_login_handlers(args, schedule):
+    """
+    Yield (username, delay, runtime, login_handler) for each user in schedule
+    """
+    if args.auth != 'lti':
+        for username, delay, runtime in schedule:
+            yield username, delay, runtime, None
+        return
+
+    launch_url = args.lti_launch_url or f'{args.hub_url}/hub/lti/launch'
+    now = time.time()
+    loop = asyncio.get_running_loop()
+    if isinstance(schedule, list):
+        # Sign all launches up front in worker processes, timestamped with
+        # when each user will actually launch.
+        launches = await loop.run_in_executor(
+            None,
+            partial(
+                sign_launches,
+                [(username, now + delay) for username, delay, _ in schedule],
+                args.lti_consumer_key,
+                args.lti_consumer_secret,
+                launch_url,
+                workers=args.lti_signing_workers,
+            ),
+        )
+        for (username, delay, runtime), launch_args in zip(schedule, launches):
+            yield username, delay, runtime, partial(login_lti, launch_args=launch_args)
+    else:
+        # Schedule is streamed, so it is signed in batches as it is read, in
+        # worker processes kept for the whole run. The next batch is signed
+        # while users of the current one are launched.
+        executor = ProcessPoolExecutor(args.lti_signing_workers)
+        schedule = iter(schedule)
+
+        def sign_next_batch():
+            batch = list(itertools.islice(schedule, LTI_SIGNING_BATCH_SIZE))
+            if not batch:
+                return batch, None
+            future = executor.submit(
+                sign_launch_batch,
+                [(username, now + delay) for username, delay, _ in batch],
+                args.lti_consumer_key,
+                args.lti_consumer_secret,
+                launch_url,
+            )
+            return batch, asyncio.wrap_future(future)
+
+        try:
+            batch, signed = sign_next_batch()
+            while batch:
+                next_batch, next_signed = sign_next_batch()
+                for (username, delay, runtime), launch_args in zip(batch, await signed):
+                    yield username, delay, runtime, partial(
+                        login_lti, launch_args=launch_args
+                    )
+                batch, signed = next_batch, next_signed
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def run(args, connector=None, clock=time.monotonic, session_factory=None):
+    """
+    Simulate users, returning a Counter of how their sessions ended
+
+    If connector is passed, all users share it instead of opening their own.
+    clock & session_factory are passed on to every User, and clock paces user
+    arrivals.
+    """
+    # FIXME: Pass in individual arguments, not argparse object
+    if args.replay:
+        schedule = (
+            (f'{args.user_prefix}-' + str(i), delay, int(runtime))
+            for i, (_, delay, runtime) in zip(
+                range(args.user_count),
+                replay_schedule(args.replay, args.time_compression),
+            )
+        )
+    else:
+        schedule = random_schedule(args)
+
+    async with contextlib.AsyncExitStack() as stack:
+        monitor = None
+        if args.monitor_interval:
+            monitor = await stack.enter_async_context(
+                SaturationMonitor(args.monitor_interval, args.max_loop_lag)
+            )
 
-    outputs = await asyncio.gather(*awaits)
-    print(Counter(outputs))
+        tracer = RequestTracer() if args.trace_requests else None
+        shutdown = ShutdownManager(args.teardown_concurrency, args.teardown_retries)
+        tasks = set()
+        outputs = Counter()
+
+        def user_done(task):
+            tasks.discard(task)
+            if task.cancelled():
+                outputs['interrupted'] += 1
+            elif task.exception() is not None:
+                outputs['error'] += 1
+            else:
+                outputs[task.result()] += 1
+
+        async def launch_users():
+            # Users are only created once it is time for them to arrive, so a
+            # streamed schedule is never fully held in memory
+            start_time = clock()
+            async for username, delay, runtime, login_handler in with_login_handlers(
+                args, schedule
+            ):
+                wait = start_time + delay - clock()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                cell = None
+                if args.workload:
+                    cell = choose_cell(args.workload, username)
+                task = asyncio.ensure_future(
+                    simulate_user(
+                        args.hub_url,
+                        username,
+                        'hello',
+                        0,
+                        runtime,
+                        get_execute_mode(args),
+                        args.execute_rate,
+                        args.credential_store,
+                        login_handler,
+                        shutdown,
+                        tracer,
+                        connector,
+                        cell,
+                        clock,
+                        session_factory,
+                    )
+                )
+                tasks.add(task)
+                task.add_done_callback(user_done)
+            while tasks:
+                await asyncio.wait(list(tasks))
+
+        interrupted = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        # Signal handlers can only be set from the main thread. They are
+        # removed when we return, as run may be called again on this loop.
+        if threading.current_thread() is threading.main_thread():
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, interrupted.set)
+                stack.callback(loop.remove_signal_handler, sig)
+
+        launcher = asyncio.ensure_future(launch_users())
+        interrupt_task = asyncio.ensure_future(interrupted.wait())
+        await asyncio.wait(
+            [launcher, interrupt_task],
+            timeout=args.run_deadline,
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+        interrupt_task.cancel()
+        if not launcher.done():
+            print('Interrupted' if interrupted.is_set() else 'Run deadline reached')
+            launcher.cancel()
+            await shutdown.shutdown(list(tasks), args.teardown_deadline)
+        elif launcher.exception() is not None:
+            # eg. an unreadable --replay log. Users already launched are
+            # torn down before the error is raised.
+            print('Launching users failed')
+            await shutdown.shutdown(list(tasks), args.teardown_deadline)
+            raise launcher.exception()
+
+    if monitor is not None:
+        saturated = sum(end - start for start, end in monitor.saturated_windows)
+        if saturated:
+            print(
+                f'Warning: load generator was saturated for {saturated:.0f}s, '
+                'durations measured then are inflated'
+            )
+
+    if tracer is not None:
+        tracer.print_report()
+    print(outputs)
+    return outputs
 
 
 def main():
@@ -59,7 +320,11 @@ def main():
     argparser.add_argument(
         'hub_url', help='Hub URL to send traffic to (without a trailing /)'
     )
-    argparser.add_argument('user_count', type=int, help='Number of users to simulate')
+    argparser.add_argument(
+        'user_count',
+        type=int,
+        help='Number of users to simulate. With --replay, max number of sessions to replay',
+    )
     argparser.add_argument(
         '--user-prefix',
         default=socket.gethostname(),
@@ -83,19 +348,89 @@ def main():
         type=int,
         help='Max seconds by which all users should have logged in',
     )
+    add_execute_arguments(argparser)
+    argparser.add_argument(
+        '--workload',
+        action='append',
+        default=[],
+        help=(
+            'Cell users run, as kind=amount[:weight], where kind is cpu (seconds), '
+            'memory or disk (megabytes). Repeat to assign users a cell by weight'
+        ),
+    )
+    argparser.add_argument(
+        '--credential-store',
+        help='Directory of credentials saved by hubtraf-provision, to skip logging in',
+    )
+    argparser.add_argument(
+        '--auth',
+        default='dummy',
+        choices=['dummy', 'lti'],
+        help='How users log in to the hub',
+    )
+    argparser.add_argument(
+        '--lti-consumer-key',
+        default=os.environ.get('LTI_CONSUMER_KEY'),
+        help='LTI consumer key, defaults to $LTI_CONSUMER_KEY',
+    )
+    argparser.add_argument(
+        '--lti-consumer-secret',
+        default=os.environ.get('LTI_CONSUMER_SECRET'),
+        help='LTI consumer secret, defaults to $LTI_CONSUMER_SECRET',
+    )
+    argparser.add_argument(
+        '--lti-launch-url',
+        help='URL LTI launches are signed for, if the hub sees it differently than hub_url/hub/lti/launch',
+    )
+    argparser.add_argument(
+        '--lti-signing-workers',
+        type=int,
+        help='Worker processes used to sign LTI launches, defaults to CPU count',
+    )
+    argparser.add_argument(
+        '--run-deadline',
+        type=int,
+        help='Max seconds the whole run may take before all users are torn down',
+    )
+    add_teardown_arguments(argparser)
+    argparser.add_argument(
+        '--teardown-deadline',
+        default=120,
+        type=int,
+        help='Max seconds to spend tearing down users on interrupt or run deadline',
+    )
+    add_monitor_arguments(argparser)
+    argparser.add_argument(
+        '--replay',
+        help='Processed event log to replay user arrivals & session lengths from, '
+        'instead of generating them randomly',
+    )
+    argparser.add_argument(
+        '--time-compression',
+        default=1,
+        type=float,
+        help='Replay the log this many times faster than it was recorded',
+    )
+    argparser.add_argument(
+        '--trace-requests',
+        action='store_true',
+        help='Break down time spent in every request (dns, connect, time to first byte etc) '
+        'and in every code execution (kernel busy, execute_input, output, idle, reply)',
+    )
     argparser.add_argument(
         '--json', action='store_true', help='True if output should be JSON formatted'
     )
     args = argparser.parse_args()
 
-    processors = [structlog.processors.TimeStamper(fmt="ISO")]
-
-    if args.json:
-        processors.append(structlog.processors.JSONRenderer())
-    else:
-        processors.append(structlog.dev.ConsoleRenderer())
+    check_execute_arguments(argparser, args)
+    if args.auth == 'lti' and not (args.lti_consumer_key and args.lti_consumer_secret):
+        argparser.error('--lti-consumer-key and --lti-consumer-secret are required')
+    try:
+        args.workload = [parse_workload(w) for w in args.workload]
+    except ValueError as e:
+        argparser.error(str(e))
 
-    structlog.configure(processors=processors)
+    configure_structlog(args.json)
 
     loop = asyncio.get_event_loop()
     loop.run_until_complete(run(args))
@@ -0,0 +1,151 @@
+"""
+Small statistics helpers used to summarize latencies collected by hubtraf
+"""
+
+import math
+from collections import defaultdict
+
+
+def percentile(sorted_values, q):
+    """
+    Return the q-th percentile (0-100) of an already sorted list of values.
+
+    Uses linear interpolation between closest ranks, same as numpy's default.
+
+    >>> percentile([1, 2, 3, 4], 50)
+    2.5
+    >>> percentile([5], 99)
+    5
+    """
+    if not sorted_values:
+        return None
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    rank = (len(sorted_values) - 1) * q / 100
+    low = math.floor(rank)
+    high = math.ceil(rank)
+    if low == high:
+        return sorted_values[low]
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (
+        rank - low
+    )
+
+
+def summarize(values, percentiles=(50, 95, 99)):
+    """
+    Summarize a list of latencies into count, mean, max and the given percentiles.
+
+    >>> summarize([1, 2, 3, 4])
+    {'count': 4, 'mean': 2.5, 'max': 4, 'p50': 2.5, 'p95': 3.85, 'p99': 3.97}
+    """
+    if not values:
+        return {'count': 0}
+    sorted_values = sorted(values)
+    summary = {
+        'count': len(sorted_values),
+        'mean': sum(sorted_values) / len(sorted_values),
+        'max': sorted_values[-1],
+    }
+    for q in percentiles:
+        summary[f'p{q}'] = round(percentile(sorted_values, q), 6)
+    return summary
+
+
+class Stats:
+    """
+    Collect the outcome & duration of User actions in-process.
+
+    Pass an instance as `stats` to User to have it record every success and
+    failure it reports, so runs can be summarized without parsing the logs.
+    """
+
+    def __init__(self):
+        # action -> list of durations of successful attempts
+        self.durations = defaultdict(list)
+        # action -> list of usernames that failed it
+        self.failures = defaultdict(list)
+
+    def record(self, kind, username, success, duration=None):
+        if success:
+            if duration is not None:
+                self.durations[kind].append(duration)
+        else:
+            self.failures[kind].append(username)
+
+    def record_durations(self, kind, durations):
+        """
+        Record many durations of successful attempts at once
+        """
+        self.durations[kind].extend(durations)
+
+    def summary(self):
+        """
+        Return {action: latency summary} for every action seen so far.
+
+        Each summary also has a 'failed' count.
+        """
+        summary = {}
+        for kind in sorted(set(self.durations) | set(self.failures)):
+            summary[kind] = summarize(self.durations.get(kind, []))
+            summary[kind]['failed'] = len(self.failures.get(kind, []))
+        return summary
+
+
+class Histogram:
+    """
+    Histogram of durations with fixed, logarithmically sized buckets.
+
+    Memory use & cost of adding a value are constant no matter how many
+    values are added. Percentiles are accurate to within one bucket, which
+    is about 9% with the default 8 buckets per doubling.
+    """
+
+    def __init__(self, min_value=0.0001, max_value=3600, buckets_per_doubling=8):
+        self.min_value = min_value
+        self.log_factor = math.log(2) / buckets_per_doubling
+        # First bucket is for values <= min_value, last for values > max_value
+        self.counts = [0] * (
+            math.ceil(math.log(max_value / min_value) / self.log_factor) + 2
+        )
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        if value <= self.min_value:
+            i = 0
+        else:
+            i = min(
+                int(math.log(value / self.min_value) / self.log_factor) + 1,
+                len(self.counts) - 1,
+            )
+        self.counts[i] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q):
+        """
+        Return upper bound of the bucket the q-th percentile (0-100) falls in
+        """
+        if not self.count:
+            return None
+        target = q / 100 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target and count:
+                return min(self.min_value * math.exp(i * self.log_factor), self.max)
+        return self.max
+
+    def summary(self, percentiles=(50, 95, 99)):
+        if not self.count:
+            return {'count': 0}
+        summary = {
+            'count': self.count,
+            'mean': self.total / self.count,
+            'max': self.max,
+        }
+        for q in percentiles:
+            summary[f'p{q}'] = round(self.percentile(q), 6)
+        return summary
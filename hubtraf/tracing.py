@@ -0,0 +1,150 @@
+"""
+Break down the time spent in each HTTP request made by simulated users
+"""
+
+import time
+from collections import defaultdict
+
+import aiohttp
+
+from hubtraf.stats import Histogram
+
+PHASES = ['queued', 'dns', 'connect', 'ttfb', 'headers']
+
+# Segments of a code execution, as (phase, from milestone, to milestone)
+EXECUTE_SEGMENTS = [
+    # websocket & proxy latency, plus the kernel picking up the request
+    ('sent-busy', 'sent', 'busy'),
+    ('busy-input', 'busy', 'execute_input'),
+    # actually running the code
+    ('input-output', 'execute_input', 'output'),
+    ('output-idle', 'output', 'idle'),
+    ('sent-reply', 'sent', 'execute_reply'),
+]
+
+
+class RequestTracer:
+    """
+    Record per-phase timings of every request made by users, by action.
+
+    Pass an instance as `tracer` to User. For each request the following
+    phases are recorded, when they happen:
+
+    queued - waiting for a free connection in the pool
+    dns - resolving the hostname
+    connect - opening a new connection, including the TLS handshake
+    ttfb - from the request being sent to response headers being received
+    headers - from the request starting to response headers being received.
+              Reading the body isn't included, aiohttp has no signal for
+              when it is done.
+
+    Time between kernel protocol milestones of every code execution is
+    recorded under the code-execute action too, see EXECUTE_SEGMENTS.
+
+    Timings are kept in a Histogram per (action, phase), shared by all users,
+    so memory use doesn't grow with the number of users or requests.
+    """
+
+    def __init__(self):
+        self.histograms = defaultdict(Histogram)
+        self.errors = defaultdict(int)
+
+    def trace_config(self, user):
+        """
+        Return an aiohttp.TraceConfig that records requests made by user
+        """
+
+        async def on_request_start(session, ctx, params):
+            ctx.action = user.action or 'unknown'
+            ctx.start = ctx.sent = time.perf_counter()
+
+        async def on_headers_sent(session, ctx, params):
+            ctx.sent = time.perf_counter()
+
+        async def on_hop_end(session, ctx, params):
+            # Each redirect is a separate hop with its own time to first byte
+            self.histograms[ctx.action, 'ttfb'].add(time.perf_counter() - ctx.sent)
+
+        async def on_request_end(session, ctx, params):
+            now = time.perf_counter()
+            self.histograms[ctx.action, 'ttfb'].add(now - ctx.sent)
+            self.histograms[ctx.action, 'headers'].add(now - ctx.start)
+
+        async def on_request_exception(session, ctx, params):
+            self.errors[ctx.action] += 1
+
+        def phase_callbacks(phase):
+            async def on_start(session, ctx, params):
+                setattr(ctx, phase, time.perf_counter())
+
+            async def on_end(session, ctx, params):
+                self.histograms[ctx.action, phase].add(
+                    time.perf_counter() - getattr(ctx, phase)
+                )
+
+            return on_start, on_end
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_headers_sent.append(on_headers_sent)
+        trace_config.on_request_redirect.append(on_hop_end)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        for phase, start_signal, end_signal in [
+            (
+                'queued',
+                trace_config.on_connection_queued_start,
+                trace_config.on_connection_queued_end,
+            ),
+            (
+                'dns',
+                trace_config.on_dns_resolvehost_start,
+                trace_config.on_dns_resolvehost_end,
+            ),
+            (
+                'connect',
+                trace_config.on_connection_create_start,
+                trace_config.on_connection_create_end,
+            ),
+        ]:
+            on_start, on_end = phase_callbacks(phase)
+            start_signal.append(on_start)
+            end_signal.append(on_end)
+        return trace_config
+
+    def record_execute(self, milestones):
+        """
+        Record time between kernel protocol milestones of one code execution.
+
+        milestones is as returned by User._execute_once. Segments whose
+        milestones weren't both reached are skipped.
+        """
+        for phase, start, end in EXECUTE_SEGMENTS:
+            if start in milestones and end in milestones:
+                self.histograms['code-execute', phase].add(
+                    milestones[end] - milestones[start]
+                )
+
+    def summary(self):
+        """
+        Return {action: {phase: latency summary}}
+        """
+        summary = defaultdict(dict)
+        for (action, phase), histogram in sorted(self.histograms.items()):
+            summary[action][phase] = histogram.summary()
+        for action, errors in self.errors.items():
+            summary[action]['errors'] = errors
+        return dict(summary)
+
+    def print_report(self):
+        print('Request timings:')
+        for action, phases in self.summary().items():
+            print(f'  {action}:')
+            for phase in PHASES + [segment[0] for segment in EXECUTE_SEGMENTS]:
+                if phase in phases:
+                    summary_pretty = " ".join(
+                        [f"{k}:{round(v, 4)}" for k, v in phases[phase].items()]
+                    )
+                    print(f'    {phase} {summary_pretty}')
+            if 'errors' in phases:
+                print(f'    errors {phases["errors"]}')
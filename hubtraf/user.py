@@ -9,6 +9,8 @@ import colorama
 import structlog
 from yarl import URL
 
+from hubtraf.stats import summarize
+
 logger = structlog.get_logger()
 
 
@@ -19,14 +21,39 @@ class User:
         SERVER_STARTED = 3
         KERNEL_STARTED = 4
 
+    class ExecuteModes(Enum):
+        THINK = 1
+        CLOSED_LOOP = 2
+        FIXED_RATE = 3
+
     async def __aenter__(self):
-        self.session = aiohttp.ClientSession()
+        trace_configs = None
+        if self.tracer is not None:
+            trace_configs = [self.tracer.trace_config(self)]
+        if self.session_factory is not None:
+            self.session = self.session_factory()
+        else:
+            self.session = aiohttp.ClientSession(
+                connector=self.connector,
+                connector_owner=self.connector is None,
+                trace_configs=trace_configs,
+            )
         return self
 
     async def __aexit__(self, exc_type, exc, tb):
         await self.session.close()
 
-    def __init__(self, username, hub_url, login_handler):
+    def __init__(
+        self,
+        username,
+        hub_url,
+        login_handler,
+        connector=None,
+        stats=None,
+        tracer=None,
+        clock=time.monotonic,
+        session_factory=None,
+    ):
         """
         A simulated JupyterHub user.
 
@@ -43,6 +70,19 @@ class User:
                         a success.
 
                         Usually a partial of a generic function is passed in here.
+        connector - an optional aiohttp connector to share a connection pool between
+                    many users. Each user still gets its own session & cookie jar.
+        stats - an optional hubtraf.stats.Stats object that will be passed the
+                outcome and duration of every action this user performs.
+        tracer - an optional hubtraf.tracing.RequestTracer object that records the
+                 timing breakdown of every request this user makes.
+        clock - function returning the current time in seconds, used for all
+                durations & timeouts. hubtraf-harness passes its virtual clock.
+        session_factory - an optional callable returning the session to use instead
+                          of an aiohttp ClientSession. It only needs the parts of
+                          ClientSession that User & the login handlers use.
+                          hubtraf-harness passes one that calls its fake hub
+                          in-process, without sockets.
         """
         self.username = username
         self.hub_url = URL(hub_url)
@@ -52,9 +92,21 @@ class User:
 
         self.log = logger.bind(username=username)
         self.login_handler = login_handler
+        self.connector = connector
+        self.clock = clock
+        self.session_factory = session_factory
+        self.stats = stats
+        self.tracer = tracer
+        # Action currently being performed, used to tag traced requests
+        self.action = None
+        # Set once a server start has been requested, even if it never
+        # finished, so the server can still be stopped on cleanup
+        self.spawn_requested = False
         self.headers = {'Referer': str(self.hub_url / 'hub/')}
 
     def success(self, kind, **kwargs):
+        if self.stats is not None:
+            self.stats.record(kind, self.username, True, kwargs.get('duration'))
         kwargs_pretty = " ".join([f"{k}:{v}" for k, v in kwargs.items()])
         print(
             f'{colorama.Fore.GREEN}Success:{colorama.Style.RESET_ALL}',
@@ -64,6 +116,8 @@ class User:
         )
 
     def failure(self, kind, **kwargs):
+        if self.stats is not None:
+            self.stats.record(kind, self.username, False, kwargs.get('duration'))
         kwargs_pretty = " ".join([f"{k}:{v}" for k, v in kwargs.items()])
         print(
             f'{colorama.Fore.RED}Failure:{colorama.Style.RESET_ALL}',
@@ -91,8 +145,9 @@ class User:
         """
         # We only log in if we haven't done anything already!
         assert self.state == User.States.CLEAR
+        self.action = 'login'
 
-        start_time = time.monotonic()
+        start_time = self.clock()
         logged_in = await self.login_handler(
             log=self.log,
             hub_url=self.hub_url,
@@ -106,12 +161,22 @@ class User:
         )
         if hub_cookie:
             self.log = self.log.bind(hub=hub_cookie.value)
-        self.success('login', duration=time.monotonic() - start_time)
+        self.success('login', duration=self.clock() - start_time)
         self.state = User.States.LOGGED_IN
         return True
 
-    async def ensure_server_api(self, api_token, timeout=300, spawn_refresh_time=30):
+    async def ensure_server_api(
+        self, api_token, timeout=300, spawn_refresh_time=30, poller=None
+    ):
+        """
+        Start the user's server with the hub API, and wait for it to be ready.
+
+        If poller (a hubtraf.poller.ServerStatusPoller) is passed, it is used to
+        wait for the server to be ready instead of polling for this user alone.
+        If it isn't ready within timeout seconds, server-start fails.
+        """
         api_url = self.hub_url / 'hub/api'
+        self.action = 'server-start'
         self.headers['Authorization'] = f'token {api_token}'
 
         async def server_running():
@@ -128,45 +193,72 @@ class User:
                 )
                 return server.get('ready', False)
 
-        self.debug('server-start', phase='start')
-        start_time = time.monotonic()
-
-        async with self.session.post(
-            api_url / 'users' / self.username / 'server', headers=self.headers
-        ) as resp:
-            if resp.status == 201:
-                # Server created
-                # FIXME: Verify this server is actually up
-                self.success('server-start', duration=time.monotonic() - start_time)
-                self.state = User.States.SERVER_STARTED
-                return True
-            elif resp.status == 202:
-                # Server start request received, not necessarily started
-                # FIXME: Verify somehow?
-                self.debug('server-start', phase='waiting')
+        async def wait_until_ready():
+            if poller is not None:
+                await poller.wait_until_ready(self.username)
+            else:
                 while not (await server_running()):
                     await asyncio.sleep(0.5)
-                self.success('server-start', duration=time.monotonic() - start_time)
-                self.state = User.States.SERVER_STARTED
-                return True
-            elif resp.status == 400:
-                body = await resp.json()
-                if body['message'] == f'{self.username} is already running':
+
+        self.debug('server-start', phase='start')
+        start_time = self.clock()
+
+        try:
+            self.spawn_requested = True
+            async with self.session.post(
+                api_url / 'users' / self.username / 'server', headers=self.headers
+            ) as resp:
+                if resp.status == 201:
+                    # Server created
+                    # FIXME: Verify this server is actually up
+                    self.success('server-start', duration=self.clock() - start_time)
+                    self.state = User.States.SERVER_STARTED
+                    return True
+                elif resp.status == 202:
+                    # Server start request received, not necessarily started
+                    # FIXME: Verify somehow?
+                    self.debug('server-start', phase='waiting')
+                    try:
+                        await asyncio.wait_for(wait_until_ready(), timeout)
+                    except asyncio.TimeoutError:
+                        # The server is left to teardown, spawn_requested is set
+                        self.failure(
+                            'server-start',
+                            reason='timeout',
+                            duration=self.clock() - start_time,
+                        )
+                        return False
+                    self.success('server-start', duration=self.clock() - start_time)
                     self.state = User.States.SERVER_STARTED
                     return True
-            print(await resp.json())
-            print(resp.request_info)
+                elif resp.status == 400:
+                    body = await resp.json()
+                    if body['message'] == f'{self.username} is already running':
+                        self.state = User.States.SERVER_STARTED
+                        return True
+                self.failure(
+                    'server-start',
+                    exception=str(resp),
+                    duration=self.clock() - start_time,
+                )
+                return False
+        except Exception as e:
+            self.failure(
+                'server-start', exception=str(e), duration=self.clock() - start_time
+            )
             return False
 
     async def ensure_server_simulate(self, timeout=300, spawn_refresh_time=30):
         assert self.state == User.States.LOGGED_IN
+        self.action = 'server-start'
 
-        start_time = time.monotonic()
+        start_time = self.clock()
         self.debug('server-start', phase='start')
         i = 0
         while True:
             i += 1
             self.debug('server-start', phase='attempt-start', attempt=i + 1)
+            self.spawn_requested = True
             try:
                 resp = await self.session.get(self.hub_url / 'hub/spawn')
             except Exception as e:
@@ -175,7 +267,7 @@ class User:
                     exception=str(e),
                     attempt=i + 1,
                     phase='attempt-failed',
-                    duration=time.monotonic() - start_time,
+                    duration=self.clock() - start_time,
                 )
                 continue
             # Check if paths match, ignoring query string (primarily, redirects=N), fragments
@@ -189,7 +281,7 @@ class User:
                     'server-start',
                     phase='complete',
                     attempt=i + 1,
-                    duration=time.monotonic() - start_time,
+                    duration=self.clock() - start_time,
                 )
                 break
             target_url_lab = self.notebook_url / 'lab'
@@ -202,14 +294,14 @@ class User:
                     'server-start',
                     phase='complete',
                     attempt=i + 1,
-                    duration=time.monotonic() - start_time,
+                    duration=self.clock() - start_time,
                 )
                 break
-            if time.monotonic() - start_time >= timeout:
+            if self.clock() - start_time >= timeout:
                 self.failure(
                     'server-start',
                     phase='failed',
-                    duration=time.monotonic() - start_time,
+                    duration=self.clock() - start_time,
                     reason='timeout',
                 )
                 return False
@@ -218,7 +310,7 @@ class User:
                 'server-start',
                 resp=str(resp),
                 phase='attempt-complete',
-                duration=time.monotonic() - start_time,
+                duration=self.clock() - start_time,
                 attempt=i + 1,
             )
             # FIXME: Add jitter?
@@ -229,9 +321,13 @@ class User:
         return True
 
     async def stop_server(self):
-        assert self.state == User.States.SERVER_STARTED
+        assert (
+            self.state in (User.States.SERVER_STARTED, User.States.KERNEL_STARTED)
+            or self.spawn_requested
+        )
+        self.action = 'server-stop'
         self.debug('server-stop', phase='start')
-        start_time = time.monotonic()
+        start_time = self.clock()
         try:
             resp = await self.session.delete(
                 self.hub_url / 'hub/api/users' / self.username / 'server',
@@ -239,25 +335,28 @@ class User:
             )
         except Exception as e:
             self.failure(
-                'server-stop', exception=str(e), duration=time.monotonic() - start_time
+                'server-stop', exception=str(e), duration=self.clock() - start_time
             )
             return False
         if resp.status != 202 and resp.status != 204:
             self.failure(
                 'server-stop',
                 exception=str(resp),
-                duration=time.monotonic() - start_time,
+                duration=self.clock() - start_time,
             )
             return False
-        self.success('server-stop', duration=time.monotonic() - start_time)
+        self.success('server-stop', duration=self.clock() - start_time)
+        self.spawn_requested = False
+        # Stopping the server stops its kernels too
         self.state = User.States.LOGGED_IN
         return True
 
     async def start_kernel(self):
         assert self.state == User.States.SERVER_STARTED
+        self.action = 'kernel-start'
 
         self.debug('kernel-start', phase='start')
-        start_time = time.monotonic()
+        start_time = self.clock()
 
         try:
             resp = await self.session.post(
@@ -265,7 +364,7 @@ class User:
             )
         except Exception as e:
             self.failure(
-                'kernel-start', exception=str(e), duration=time.monotonic() - start_time
+                'kernel-start', exception=str(e), duration=self.clock() - start_time
             )
             return False
 
@@ -273,11 +372,11 @@ class User:
             self.failure(
                 'kernel-start',
                 exception=str(resp),
-                duration=time.monotonic() - start_time,
+                duration=self.clock() - start_time,
             )
             return False
         self.kernel_id = (await resp.json())['id']
-        self.success('kernel-start', duration=time.monotonic() - start_time)
+        self.success('kernel-start', duration=self.clock() - start_time)
         self.state = User.States.KERNEL_STARTED
         return True
 
@@ -293,16 +392,17 @@ class User:
 
     async def stop_kernel(self):
         assert self.state == User.States.KERNEL_STARTED
+        self.action = 'kernel-stop'
 
         self.debug('kernel-stop', phase='start')
-        start_time = time.monotonic()
+        start_time = self.clock()
         try:
             resp = await self.session.delete(
                 self.notebook_url / 'api/kernels' / self.kernel_id, headers=self.headers
             )
         except Exception as e:
             self.failure(
-                'kernel-stop', exception=str(e), duration=time.monotonic() - start_time
+                'kernel-stop', exception=str(e), duration=self.clock() - start_time
             )
             return False
 
@@ -310,11 +410,11 @@ class User:
             self.failure(
                 'kernel-stop',
                 exception=str(resp),
-                duration=time.monotonic() - start_time,
+                duration=self.clock() - start_time,
             )
             return False
 
-        self.success('kernel-stop', duration=time.monotonic() - start_time)
+        self.success('kernel-stop', duration=self.clock() - start_time)
         self.state = User.States.SERVER_STARTED
         return True
 
@@ -340,60 +440,147 @@ class User:
             "channel": "shell",
         }
 
+    async def _execute_once(self, ws, code, output):
+        """
+        Send one execute_request over ws and wait for it to be fully processed.
+
+        Returns (milestones, None) on success, or (milestones, reason) with the
+        unexpected websocket message or reason on failure. milestones maps
+        kernel protocol milestones - 'sent', 'busy', 'execute_input', 'output',
+        'idle' & 'execute_reply' - to the self.clock() time they were reached.
+        """
+        msg_id = str(uuid.uuid4())
+        milestones = {'sent': self.clock()}
+        await ws.send_json(self.request_execute_code(msg_id, code))
+        async for msg_text in ws:
+            if msg_text.type != aiohttp.WSMsgType.TEXT:
+                return milestones, msg_text
+
+            msg = msg_text.json()
+
+            if 'parent_header' in msg and msg['parent_header'].get('msg_id') == msg_id:
+                # These are responses to our request
+                now = self.clock()
+                if msg['channel'] == 'iopub':
+                    response = None
+                    if msg['msg_type'] == 'status':
+                        state = msg['content']['execution_state']
+                        if state in ('busy', 'idle'):
+                            milestones.setdefault(state, now)
+                    elif msg['msg_type'] == 'execute_input':
+                        milestones.setdefault('execute_input', now)
+                    elif msg['msg_type'] == 'execute_result':
+                        response = msg['content']['data']['text/plain']
+                    elif msg['msg_type'] == 'stream':
+                        response = msg['content']['text']
+                    if response and 'output' not in milestones:
+                        assert response == output
+                        milestones['output'] = now
+                elif msg['msg_type'] == 'execute_reply':
+                    milestones['execute_reply'] = now
+
+                if 'idle' in milestones and 'execute_reply' in milestones:
+                    if 'output' not in milestones:
+                        return milestones, 'kernel went idle without producing output'
+                    return milestones, None
+        return milestones, 'websocket closed before execution completed'
+
     async def assert_code_output(
-        self, code, output, execute_timeout, repeat_time_seconds=None
+        self,
+        code,
+        output,
+        execute_timeout,
+        repeat_time_seconds=None,
+        mode=None,
+        rate=None,
     ):
+        """
+        Execute code in the kernel and check it produces output.
+
+        If repeat_time_seconds is set, code is executed repeatedly for that long.
+        How iterations are paced is determined by mode:
+
+        User.ExecuteModes.THINK - pause randomly between 0 and 1s between
+                                  iterations, like a (very fast) human would.
+        User.ExecuteModes.CLOSED_LOOP - send the next execute_request as soon as
+                                        the previous one completes, to find the
+                                        max executes/sec a kernel can sustain.
+        User.ExecuteModes.FIXED_RATE - start iterations at a fixed rate of `rate`
+                                       executes/sec.
+
+        Latency of every iteration, until the expected output is received, is
+        recorded in self.execute_latencies. It is measured from when the iteration
+        was *supposed* to start, not when it actually did, so time spent queued
+        behind a slow previous iteration is not hidden. An iteration only ends
+        once the kernel is idle & has replied, and if a tracer is set the time
+        between each of those kernel protocol milestones is recorded too.
+        """
+        if mode is None:
+            mode = User.ExecuteModes.THINK
+        if mode == User.ExecuteModes.FIXED_RATE and not rate:
+            raise ValueError('rate is required for FIXED_RATE execute mode')
+
+        mode_name = mode.name.lower().replace('_', '-')
+        self.action = 'code-execute'
+
         channel_url = self.notebook_url / 'api/kernels' / self.kernel_id / 'channels'
+        self.execute_latencies = []
         self.debug('kernel-connect', phase='start')
         try:
             async with self.session.ws_connect(channel_url, headers=self.headers) as ws:
                 self.debug('kernel-connect', phase='complete')
-                start_time = time.monotonic()
+                start_time = self.clock()
                 iteration = 0
-                self.debug('code-execute', phase='start')
+                self.debug('code-execute', phase='start', mode=mode_name)
                 while True:
-                    exec_start_time = time.monotonic()
+                    if mode == User.ExecuteModes.FIXED_RATE:
+                        intended_start_time = start_time + iteration / rate
+                        delay = intended_start_time - self.clock()
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                    else:
+                        intended_start_time = self.clock()
                     iteration += 1
-                    msg_id = str(uuid.uuid4())
-                    await ws.send_json(self.request_execute_code(msg_id, code))
-                    async for msg_text in ws:
-                        if msg_text.type != aiohttp.WSMsgType.TEXT:
-                            self.failure(
-                                'code-execute',
-                                iteration=iteration,
-                                message=str(msg_text),
-                                duration=time.monotonic() - exec_start_time,
-                            )
-                            return False
-
-                        msg = msg_text.json()
-
-                        if (
-                            'parent_header' in msg
-                            and msg['parent_header'].get('msg_id') == msg_id
-                        ):
-                            # These are responses to our request
-                            if msg['channel'] == 'iopub':
-                                response = None
-                                if msg['msg_type'] == 'execute_result':
-                                    response = msg['content']['data']['text/plain']
-                                elif msg['msg_type'] == 'stream':
-                                    response = msg['content']['text']
-                                if response:
-                                    assert response == output
-                                    duration = time.monotonic() - exec_start_time
-                                    break
+                    milestones, unexpected = await self._execute_once(ws, code, output)
+                    if self.tracer is not None:
+                        self.tracer.record_execute(milestones)
+                    duration = (
+                        milestones.get('output', self.clock()) - intended_start_time
+                    )
+                    if unexpected is not None:
+                        self.failure(
+                            'code-execute',
+                            iteration=iteration,
+                            message=str(unexpected),
+                            duration=duration,
+                        )
+                        return False
+                    self.execute_latencies.append(duration)
                     if repeat_time_seconds:
-                        if time.monotonic() - start_time >= repeat_time_seconds:
+                        if self.clock() - start_time >= repeat_time_seconds:
                             break
-                        else:
+                        elif mode == User.ExecuteModes.THINK:
                             # Sleep a random amount of time between 0 and 1s, so we aren't busylooping
                             await asyncio.sleep(random.uniform(0, 1))
-                            continue
+                        continue
                     else:
                         break
 
-                self.success('code-execute', duration=duration, iteration=iteration)
+                elapsed = self.clock() - start_time
+                if self.stats is not None:
+                    # success() only records the last iteration
+                    self.stats.record_durations(
+                        'code-execute-iteration', self.execute_latencies
+                    )
+                latencies = summarize(self.execute_latencies)
+                self.success(
+                    'code-execute',
+                    duration=duration,
+                    iteration=iteration,
+                    mode=mode_name,
+                    throughput=round(iteration / elapsed, 3) if elapsed else 0,
+                    **{k: v for k, v in latencies.items() if k.startswith('p')},
+                )
                 return True
         except Exception as e:
             self.failure('code-execute', exception=str(e))
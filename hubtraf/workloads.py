@@ -0,0 +1,111 @@
+"""
+Cells that put realistic CPU, memory & disk load on the nodes running kernels.
+
+Each cell returns a short integer checksum as its output, computed from what
+it actually did, so users check a few digits instead of comparing whole
+outputs. The expected checksum is cheap to compute here too.
+"""
+
+import random
+import zlib
+
+MB = 1024 * 1024
+PAGE_SIZE = 4096
+
+
+def _token(kind, amount, username):
+    return f'hubtraf-{kind}-{amount}-{username}'.encode()
+
+
+def cpu_cell(seconds, username):
+    """
+    Return (code, output) of a cell that burns seconds of CPU time
+    """
+    token = _token('cpu', seconds, username)
+    code = f"""import time, zlib
+_hubtraf_start = time.process_time()
+while time.process_time() - _hubtraf_start < {seconds}:
+    sum(i * i for i in range(10000))
+zlib.crc32({token!r})"""
+    return code, str(zlib.crc32(token))
+
+
+def memory_cell(megabytes, username):
+    """
+    Return (code, output) of a cell that keeps megabytes of memory resident.
+
+    The memory stays allocated in the kernel until the cell is run again.
+    """
+    size = int(megabytes * MB)
+    # Every page is written to, so it is actually resident
+    fill = zlib.crc32(_token('memory', megabytes, username)) % 255 + 1
+    pages = len(range(0, size, PAGE_SIZE))
+    code = f"""import zlib
+_hubtraf_memory = None
+_hubtraf_memory = bytearray({size})
+_hubtraf_memory[::{PAGE_SIZE}] = bytes([{fill}]) * {pages}
+zlib.crc32(_hubtraf_memory[::{PAGE_SIZE}])"""
+    return code, str(zlib.crc32(bytes([fill]) * pages))
+
+
+def disk_cell(megabytes, username):
+    """
+    Return (code, output) of a cell that writes megabytes to disk & fsyncs it.
+
+    megabytes is rounded down to whole megabytes. The file is left in the
+    kernel's working directory, and overwritten each time the cell is run.
+    """
+    token = _token('disk', megabytes, username)
+    block = (token * (MB // len(token) + 1))[:MB]
+    blocks = int(megabytes)
+    code = f"""import os, zlib
+_hubtraf_block = ({token!r} * {MB // len(token) + 1})[:{MB}]
+with open('.hubtraf-disk', 'wb') as f:
+    for _ in range({blocks}):
+        f.write(_hubtraf_block)
+    f.flush()
+    os.fsync(f.fileno())
+zlib.crc32(_hubtraf_block) ^ os.path.getsize('.hubtraf-disk')"""
+    return code, str(zlib.crc32(block) ^ (blocks * MB))
+
+
+CELLS = {
+    'cpu': cpu_cell,
+    'memory': memory_cell,
+    'disk': disk_cell,
+}
+
+
+def parse_workload(spec):
+    """
+    Parse a workload of form kind=amount or kind=amount:weight
+
+    amount is seconds of CPU for cpu, megabytes for memory & disk.
+
+    >>> parse_workload('cpu=0.5')
+    ('cpu', 0.5, 1.0)
+    >>> parse_workload('memory=512:20')
+    ('memory', 512.0, 20.0)
+    """
+    kind, _, value = spec.partition('=')
+    if kind not in CELLS or not value:
+        raise ValueError(
+            f'Invalid workload {spec}, must be kind=amount with kind one of {list(CELLS)}'
+        )
+    amount, _, weight = value.partition(':')
+    amount, weight = float(amount), float(weight or 1)
+    if amount < 0:
+        raise ValueError(f'Invalid workload {spec}, amount must not be negative')
+    if weight <= 0:
+        raise ValueError(f'Invalid workload {spec}, weight must be positive')
+    return kind, amount, weight
+
+
+def choose_cell(workloads, username, rng=random):
+    """
+    Return (code, output) of a cell for username, chosen from weighted workloads
+
+    workloads is a list of (kind, amount, weight), as returned by parse_workload.
+    """
+    kind, amount, _ = rng.choices(workloads, weights=[w[2] for w in workloads])[0]
+    return CELLS[kind](amount, username)
@@ -12,6 +12,12 @@ setup(
         'console_scripts': [
             'hubtraf-simulate = hubtraf.simulate:main',
             'hubtraf-check = hubtraf.check:main',
+            'hubtraf-provision = hubtraf.provision:main',
+            'hubtraf-compare = hubtraf.compare:main',
+            'hubtraf-capacity = hubtraf.capacity:main',
+            'hubtraf-lookup = hubtraf.parser.index:main',
+            'hubtraf-collector = hubtraf.collector:main',
+            'hubtraf-harness = hubtraf.harness:main',
         ],
     },
     install_requires=[
@@ -20,17 +26,32 @@ setup(
         "oauthlib",
         "yarl",
         "colorama",
+        "numpy",
+        "python-dateutil",
     ],
     extras_require={
+        "collector": [
+            "msgpack",
+            "pandas",
+            "pyarrow",
+        ],
+        "zstd": [
+            "zstandard",
+        ],
         "test": [
             "ipykernel",
             "jupyter-server",
             "jupyterlab",
             "jupyterhub",
+            "msgpack",
+            "pandas",
+            "pyarrow",
             "pytest",
             "pytest-asyncio",
             "pytest-cov",
             "pytest-jupyterhub",
+            "streamz",
+            "zstandard",
         ],
     },
 )
@@ -1,3 +1,4 @@
+import asyncio
 from functools import partial
 
 import pytest
@@ -10,6 +11,38 @@ from hubtraf.user import User
 pytest_plugins = "jupyterhub-spawners-plugin"
 
 
+class FakeUser:
+    def __init__(self, username, state, failures=0, spawn_requested=None):
+        self.username = username
+        self.state = state
+        self.failures = failures
+        if spawn_requested is None:
+            spawn_requested = state != User.States.LOGGED_IN
+        self.spawn_requested = spawn_requested
+
+    async def stop_kernel(self):
+        await asyncio.sleep(0)
+        self.state = User.States.SERVER_STARTED
+        return True
+
+    async def stop_server(self):
+        await asyncio.sleep(0)
+        if self.failures:
+            self.failures -= 1
+            return False
+        self.state = User.States.LOGGED_IN
+        self.spawn_requested = False
+        return True
+
+
+@pytest.fixture
+def fake_user():
+    """
+    FakeUser class, for tests that only need users to stop kernels & servers
+    """
+    return FakeUser
+
+
 @pytest.fixture
 async def app(hub_app):
     config = Config()
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+pytest.importorskip('pandas')
+pytest.importorskip('streamz')
+
+from hubtraf.analysis.dataframe import logfile_to_df, session_table  # noqa: E402
+
+
+def test_session_table(tmp_path):
+    events = [
+        (0, 'alice', 'login', 'start', None),
+        (1, 'bob', 'login', 'start', None),
+        (2, 'alice', 'login', 'complete', 1.5),
+        (3, 'bob', 'login', 'failed', None),
+        (4, 'alice', 'server-start', 'start', None),
+        (5, 'carol', 'login', 'start', None),
+        (10, 'alice', 'server-start', 'attempt-complete', None),
+        (20, 'alice', 'server-start', 'complete', None),
+        (21, 'carol', 'login', 'complete', 2.0),
+        (25, 'alice', 'kernel-start', 'failure', None),
+    ]
+    logfile = tmp_path / 'events.log'
+    with open(logfile, 'w') as f:
+        for seconds, username, action, phase, duration in events:
+            event = {
+                'timestamp': f'2018-03-09T04:49:{seconds:02}Z',
+                'username': username,
+                'action': action,
+                'phase': phase,
+            }
+            if duration is not None:
+                event['duration'] = duration
+            f.write(json.dumps(event) + '\n')
+        f.write(json.dumps({'timestamp': '2018-03-09T04:50:00Z', 'msg': 'hi'}) + '\n')
+
+    table = session_table(logfile_to_df(logfile))
+
+    assert sorted(table.index) == ['alice', 'bob', 'carol']
+    assert list(table.columns[:4]) == [
+        'login.start',
+        'login.complete',
+        'login.failed',
+        'login.duration',
+    ]
+    assert table.loc['alice', 'login.duration'] == 1.5
+    # Not reported, so computed from start & complete
+    assert table.loc['alice', 'server-start.duration'] == 16
+    assert table['login.failed'].notna().sum() == 1
+    assert table['server-start.start'].notna().mean() == pytest.approx(1 / 3)
+    assert table.loc['alice', 'kernel-start.failed'].second == 25
+    assert (
+        table.loc['alice', 'server-start.complete'] - table.loc['alice', 'login.start']
+    ).total_seconds() == 20
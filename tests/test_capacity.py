@@ -0,0 +1,51 @@
+from collections import Counter
+
+from hubtraf.capacity import check_slos, search, step_users
+from hubtraf.shutdown import ShutdownManager
+from hubtraf.stats import Stats
+from hubtraf.user import User
+
+
+async def test_search():
+    tried = []
+
+    async def run_step(load):
+        tried.append(load)
+        return load <= 60
+
+    loads = list(range(10, 201, 10))
+    assert await search(run_step, loads) == 60
+    assert tried == [10, 20, 30, 40, 50, 60, 70]
+
+    tried.clear()
+    assert await search(run_step, loads, bisect=True) == 60
+    assert len(tried) <= 5
+
+    assert await search(run_step, [100, 200]) is None
+
+
+def test_check_slos():
+    stats = Stats()
+    stats.record_durations('server-start', [1] * 95 + [10] * 5)
+    stats.record_durations('code-execute-iteration', [0.1] * 100)
+    outcomes = Counter({'completed': 98, 'start-server': 2})
+
+    assert check_slos(stats, outcomes, 2, 0.5, 0.05) == []
+    violations = check_slos(stats, outcomes, 1, None, 0.01)
+    assert len(violations) == 2
+    assert check_slos(Stats(), Counter(), code_execute_p99=1)
+
+
+async def test_step_users_skips_leftovers(fake_user):
+    users = [
+        fake_user('done', User.States.LOGGED_IN),
+        fake_user('broken', User.States.KERNEL_STARTED, failures=10),
+        fake_user('leftover', User.States.SERVER_STARTED),
+    ]
+
+    async def make_user():
+        return fake_user(f'new-{len(users)}', User.States.LOGGED_IN)
+
+    ready = await step_users(users, 3, make_user, ShutdownManager(retries=0))
+    assert [u.username for u in ready] == ['done', 'leftover', 'new-3']
+    assert len(users) == 4
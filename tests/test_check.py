@@ -0,0 +1,39 @@
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from hubtraf.check import check_user, expand_usernames
+from hubtraf.stats import Stats
+
+
+def test_expand_usernames():
+    assert expand_usernames(['admin']) == ['admin']
+    assert expand_usernames(['user-{1..3}']) == ['user-1', 'user-2', 'user-3']
+    assert expand_usernames(['c{1..2}-u{0..1}']) == ['c1-u0', 'c1-u1', 'c2-u0', 'c2-u1']
+
+
+async def test_check_user_stops_server_after_start_timeout():
+    deleted = []
+
+    async def start_server(request):
+        return web.Response(status=202)
+
+    async def get_user(request):
+        return web.json_response({'servers': {'': {'pending': 'spawn'}}})
+
+    async def stop_server(request):
+        deleted.append(request.match_info['name'])
+        return web.Response(status=204)
+
+    app = web.Application()
+    app.router.add_post('/hub/api/users/{name}/server', start_server)
+    app.router.add_delete('/hub/api/users/{name}/server', stop_server)
+    app.router.add_get('/hub/api/users/{name}', get_user)
+    stats = Stats()
+    async with TestServer(app) as server:
+        result = await check_user(
+            str(server.make_url('/')), 'slow', 'token', deadline=0.2, stats=stats
+        )
+
+    assert result == 'start-server'
+    assert deleted == ['slow']
+    assert stats.failures['server-start'] == ['slow']
@@ -0,0 +1,99 @@
+import asyncio
+import json
+import struct
+
+import pytest
+
+msgpack = pytest.importorskip('msgpack')
+pytest.importorskip('pyarrow')
+pytest.importorskip('streamz')
+
+from hubtraf.analysis.dataframe import collected_to_df
+from hubtraf.collector import Collector, forward_events
+
+
+async def test_collector(tmp_path):
+    collector = Collector(str(tmp_path), flush_interval=0.1)
+    server = await asyncio.start_server(collector.handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+
+    # As tailed by fluent-bit from hubtraf's output
+    records = [
+        {
+            'log': json.dumps(
+                {
+                    'timestamp': f'2018-03-09T04:49:4{i}.000000Z',
+                    'username': f'user-{i}',
+                    'action': 'login',
+                    'phase': 'complete',
+                    'duration': i / 2,
+                }
+            )
+        }
+        for i in reversed(range(3))
+    ]
+    records.append({'log': 'Traceback (most recent call last):'})
+    await forward_events('127.0.0.1', port, 'hubtraf', records)
+
+    # Message mode, with an EventTime & an event sent without going through a file
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    event_time = msgpack.ExtType(0, struct.pack('>II', 1520570990, 500000000))
+    writer.write(
+        msgpack.packb(
+            ['hubtraf', event_time, {'username': 'user-3', 'action': 'login'}]
+        )
+    )
+    await writer.drain()
+    writer.close()
+
+    for _ in range(50):
+        if len(collector.pending) == 4:
+            break
+        await asyncio.sleep(0.01)
+    await collector.flush()
+    server.close()
+    await server.wait_closed()
+
+    df = collected_to_df(tmp_path)
+    assert list(df['username']) == ['user-0', 'user-1', 'user-2', 'user-3']
+    assert list(df['duration'][:3]) == [0, 0.5, 1]
+    assert str(df.index[3]) == '2018-03-09 04:49:50.500000+00:00'
+    assert collector.events_written == 4
+
+
+def test_collected_to_df_empty(tmp_path):
+    df = collected_to_df(tmp_path)
+    assert len(df) == 0
+    assert df.index.name == 'timestamp'
+
+
+async def test_collector_drops_malformed_messages(tmp_path):
+    collector = Collector(str(tmp_path))
+    handled = []
+
+    async def handle(reader, writer):
+        # Any exception escaping handle would fail the test here
+        await collector.handle(reader, writer)
+        handled.append(True)
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    messages = [
+        5,
+        ['hubtraf', {'not': 'entries'}],
+        ['hubtraf', 1520570990, 'not a record'],
+        ['hubtraf', [[1520570990]]],
+        ['hubtraf', 'not a timestamp', {'username': 'user-0'}],
+    ]
+    for message in messages:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(msgpack.packb(message))
+        await writer.drain()
+        # The collector drops the connection
+        assert await reader.read() == b''
+        writer.close()
+    server.close()
+    await server.wait_closed()
+
+    assert len(handled) == len(messages)
+    assert collector.pending == []
@@ -0,0 +1,43 @@
+import json
+import random
+
+from hubtraf.compare import compare, load_log
+
+
+def write_log(path, durations, failures=0):
+    with open(path, 'w') as f:
+        for d in durations:
+            f.write(
+                json.dumps(
+                    {'action': 'server-start', 'phase': 'complete', 'duration': d}
+                )
+                + '\n'
+            )
+        for _ in range(failures):
+            f.write(json.dumps({'action': 'server-start', 'phase': 'failed'}) + '\n')
+
+
+def test_compare_detects_regression(tmp_path):
+    rng = random.Random(1)
+    write_log(tmp_path / 'before.log', [rng.uniform(1, 2) for _ in range(2000)])
+    write_log(
+        tmp_path / 'after.log', [rng.uniform(2, 3) for _ in range(2000)], failures=500
+    )
+    before = load_log(tmp_path / 'before.log', reservoir_size=500)
+    after = load_log(tmp_path / 'after.log', reservoir_size=500)
+
+    assert after['server-start'].completed == 2000
+    assert after['server-start'].failed == 500
+    assert len(after['server-start'].durations) == 500
+
+    rows = compare(
+        before,
+        after,
+        [('*', 'p95', 20), ('server-start', 'failure_rate', 0.1)],
+        resamples=100,
+    )
+    regressed = {stat for _, stat, _, _, _, is_regressed in rows if is_regressed}
+    assert regressed == {'p95', 'failure_rate'}
+
+    rows = compare(before, before, [('*', 'p95', 20)], resamples=100)
+    assert not any(row[-1] for row in rows)
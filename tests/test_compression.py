@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+from hubtraf.parser import prepare_data
+from hubtraf.parser.compression import open_log
+
+
+@pytest.mark.parametrize('extension', ['', '.gz', '.zst'])
+def test_open_log_roundtrip(tmp_path, extension):
+    if extension == '.zst':
+        pytest.importorskip('zstandard')
+    path = tmp_path / f'events.log{extension}'
+    lines = [
+        json.dumps({'username': f'üsér-{i}', 'i': i}, ensure_ascii=False) + '\n'
+        for i in range(50000)
+    ]
+    with open_log(path, 'w') as f:
+        f.writelines(lines)
+    if not extension:
+        # utf-8, whatever the locale's encoding is
+        assert path.read_bytes().decode('utf-8') == ''.join(lines)
+    with open_log(path) as f:
+        assert list(f) == lines
+
+    # Stopping early doesn't leave the decompressing thread hanging
+    with open_log(path) as f:
+        assert next(f) == lines[0]
+
+
+def test_zstd_multiple_frames(tmp_path):
+    zstandard = pytest.importorskip('zstandard')
+    path = tmp_path / 'events.log.zst'
+    # As written by appending to a log with `zstd >>`
+    with open(path, 'wb') as f:
+        for i in range(3):
+            f.write(zstandard.ZstdCompressor().compress(f'line {i}\n'.encode()))
+    with open_log(path) as f:
+        assert list(f) == ['line 0\n', 'line 1\n', 'line 2\n']
+
+
+def test_prepare_data_compressed(tmp_path):
+    inputpath = tmp_path / 'raw.log.gz'
+    with open_log(inputpath, 'w') as f:
+        for second in [3, 1, 2]:
+            f.write(json.dumps({'timestamp': f'2018-03-09T04:49:4{second}Z'}) + '\n')
+    outputpath = tmp_path / 'processed.log.gz'
+    prepare_data(inputpath, outputpath)
+    with open_log(outputpath) as f:
+        assert [json.loads(l)['timestamp'][-3:] for l in f] == ['41Z', '42Z', '43Z']
+
+    with pytest.raises(ValueError):
+        prepare_data(inputpath, outputpath, index=True)
+
+
+def test_logfile_to_df_chunked(tmp_path):
+    pytest.importorskip('pandas')
+    pytest.importorskip('streamz')
+    from hubtraf.analysis.dataframe import logfile_to_df
+
+    path = tmp_path / 'processed.log.gz'
+    with open_log(path, 'w') as f:
+        for i in range(10):
+            f.write(
+                json.dumps(
+                    {'timestamp': f'2018-03-09T04:49:4{i}Z', 'username': f'user-{i}'}
+                )
+                + '\n'
+            )
+    df = logfile_to_df(path, chunksize=3)
+    assert list(df['username']) == [f'user-{i}' for i in range(10)]
+    assert df.equals(logfile_to_df(path))
@@ -0,0 +1,79 @@
+import argparse
+import asyncio
+from functools import partial
+
+from hubtraf.auth.dummy import login_dummy
+from hubtraf.harness import FakeHub, FakeSession, run, run_virtual
+from hubtraf.user import User
+
+
+def simulate(seed):
+    args = argparse.Namespace(
+        user_count=50,
+        user_session_min_runtime=10,
+        user_session_max_runtime=20,
+        user_session_max_start_delay=30,
+        execute_mode='think',
+        execute_rate=None,
+        teardown_concurrency=10,
+        teardown_retries=3,
+    )
+    hub = FakeHub(
+        spawn_time=60,
+        spawn_failure_rate=0.2,
+        concurrent_spawn_limit=10,
+        stop_failure_rate=0.1,
+        seed=seed,
+    )
+
+    async def timed_run():
+        outcomes = await run(args, hub)
+        return outcomes, asyncio.get_running_loop().time()
+
+    outcomes, virtual_time = run_virtual(timed_run(), seed)
+    return outcomes, virtual_time, hub.counts
+
+
+def test_harness_deterministic():
+    outcomes, virtual_time, counts = simulate(seed=1)
+
+    # Rejected & failed spawns are retried, until the user gives up
+    assert sum(outcomes.values()) == 50
+    assert 0 < outcomes['completed'] < 50
+    assert counts['spawn-rejected'] > 0
+    assert counts['spawn-failed'] > 0
+    assert counts['max-pending-spawns'] <= 10
+    # Failed stops are retried too, and servers of users who gave up
+    # waiting for them to start are stopped as well
+    assert counts['stop-failed'] > 0
+    assert counts['stop'] == 50
+    # Far more virtual time passed than a test could wait for
+    assert virtual_time > 120
+
+    assert simulate(seed=1) == (outcomes, virtual_time, counts)
+
+
+def test_fake_session_kernel_gone():
+    hub = FakeHub(spawn_time=0)
+
+    async def session():
+        async with User(
+            'user-1',
+            'http://fakehub',
+            partial(login_dummy, password='hello'),
+            clock=asyncio.get_running_loop().time,
+            session_factory=partial(FakeSession, hub),
+        ) as u:
+            assert await u.login()
+            assert await u.ensure_server_simulate()
+            assert await u.start_kernel()
+            assert await u.assert_code_output('5 * 4', '20', 5)
+            # The kernel goes away, eg. because it was culled
+            hub.kernels.clear()
+            assert not await u.assert_code_output('5 * 4', '20', 5)
+            assert not await u.stop_kernel()
+            assert await u.stop_server()
+
+    run_virtual(session())
+    assert hub.counts['execute'] == 1
+    assert hub.cpu > 0
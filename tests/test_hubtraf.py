@@ -19,3 +19,13 @@ def test_dummy():
     # weirdly the async fixtures don't work
     # unless there's at least one sync test somewhere
     pass
+
+
+async def test_execute_fixed_rate(user):
+    assert await user.login()
+    assert await user.ensure_server_simulate(timeout=120, spawn_refresh_time=5)
+    assert await user.start_kernel()
+    assert await user.assert_code_output(
+        "5 * 4", "20", 5, 2, mode=user.ExecuteModes.FIXED_RATE, rate=5
+    )
+    assert len(user.execute_latencies) > 1
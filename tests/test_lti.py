@@ -0,0 +1,54 @@
+import argparse
+from types import SimpleNamespace
+
+from oauthlib.oauth1.rfc5849 import signature
+
+from hubtraf.auth.lti import sign_launches
+from hubtraf.simulate import with_login_handlers
+
+LAUNCH_URL = 'http://localhost/hub/lti/launch'
+
+
+def verify(launch_args, consumer_secret):
+    request = SimpleNamespace(
+        http_method='POST',
+        uri=LAUNCH_URL,
+        params=[(k, v) for k, v in launch_args.items() if k != 'oauth_signature'],
+        signature=launch_args['oauth_signature'],
+    )
+    return signature.verify_hmac_sha1(request, consumer_secret)
+
+
+def test_sign_launches():
+    launches = [('user-1', 1000), ('user-2', 2000.5), ('user-3', 3000)]
+    signed = sign_launches(launches, 'key', 'secret', LAUNCH_URL, workers=2)
+
+    assert [s['user_id'] for s in signed] == ['user-1', 'user-2', 'user-3']
+    assert [s['oauth_timestamp'] for s in signed] == ['1000', '2000', '3000']
+    assert all(verify(s, 'secret') for s in signed)
+    assert not verify(signed[0], 'wrong-secret')
+
+
+async def test_with_login_handlers_streamed():
+    args = argparse.Namespace(
+        auth='lti',
+        hub_url='http://localhost',
+        lti_launch_url=LAUNCH_URL,
+        lti_consumer_key='key',
+        lti_consumer_secret='secret',
+        lti_signing_workers=2,
+    )
+    # A generator, like a --replay schedule, is signed in batches as it streams
+    schedule = ((f'user-{i}', i, 60) for i in range(600))
+    launches = [
+        (username, delay, runtime, login_handler.keywords['launch_args'])
+        async for username, delay, runtime, login_handler in with_login_handlers(
+            args, schedule
+        )
+    ]
+
+    assert [launch[0] for launch in launches] == [f'user-{i}' for i in range(600)]
+    assert all(
+        launch_args['user_id'] == username for username, _, _, launch_args in launches
+    )
+    assert all(verify(launch[3], 'secret') for launch in launches[::100])
@@ -0,0 +1,19 @@
+import asyncio
+import time
+
+from hubtraf.monitor import SaturationMonitor
+
+
+async def test_monitor_detects_lag():
+    start = time.monotonic()
+    async with SaturationMonitor(interval=0.05, max_lag=0.1, max_cpu=1000) as monitor:
+        await asyncio.sleep(0.2)
+        assert not monitor.saturated_during(start, time.monotonic())
+        # Block the event loop
+        time.sleep(0.3)
+        await asyncio.sleep(0.2)
+    end = time.monotonic()
+
+    assert len(monitor.saturated_windows) == 1
+    assert monitor.saturated_during(start, end)
+    assert not monitor.saturated_during(start, start + 0.1)
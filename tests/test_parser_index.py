@@ -0,0 +1,54 @@
+import json
+
+from hubtraf.parser import prepare_data
+from hubtraf.parser.index import action_failures, load_index, user_timeline
+
+
+def test_prepare_data_index(tmp_path):
+    events = [
+        ('00:00:02', 'bob', 'login', 'start'),
+        ('00:00:01', 'alice', 'login', 'start'),
+        ('00:00:03', 'alice', 'login', 'complete'),
+        ('00:00:04', 'bob', 'login', 'failed'),
+        ('00:00:05', 'alice', 'server-start', 'start'),
+        ('00:00:09', 'alice', 'server-start', 'failed'),
+    ]
+    inputpath = tmp_path / 'raw.log'
+    with open(inputpath, 'w') as f:
+        for time, username, action, phase in events:
+            event = {
+                'timestamp': f'2018-03-09T{time}Z',
+                'username': username,
+                'action': action,
+                'phase': phase,
+                # Offsets are in bytes, not characters
+                'msg': 'üñíçødé',
+            }
+            f.write(json.dumps(event) + '\n')
+    outputpath = tmp_path / 'processed.log'
+    prepare_data(inputpath, outputpath, index=True)
+
+    timeline = user_timeline(outputpath, 'alice')
+    assert [(e['action'], e['phase']) for e in timeline] == [
+        ('login', 'start'),
+        ('login', 'complete'),
+        ('server-start', 'start'),
+        ('server-start', 'failed'),
+    ]
+    assert user_timeline(outputpath, 'nobody') == []
+
+    failures = action_failures(outputpath, 'login')
+    assert [e['username'] for e in failures] == ['bob']
+
+    with load_index(outputpath) as index:
+        assert index.actions['login'] == {
+            'start': '2018-03-09T00:00:01Z',
+            'end': '2018-03-09T00:00:04Z',
+            'failures': 1,
+        }
+        lines = open(outputpath, 'rb').readlines()
+        assert index.user_offsets('bob') == [
+            len(b''.join(lines[:1])),
+            len(b''.join(lines[:3])),
+        ]
+        assert index.failure_offsets('code-execute') == []
@@ -0,0 +1,67 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from hubtraf.check import no_auth
+from hubtraf.poller import ServerStatusPoller
+from hubtraf.stats import Stats
+from hubtraf.user import User
+
+
+async def test_poller_batches_requests():
+    requests = []
+    polls_until_ready = {f'user-{i}': i % 3 for i in range(10)}
+
+    async def list_users(request):
+        requests.append(request)
+        offset = int(request.query['offset'])
+        limit = int(request.query['limit'])
+        users = [
+            {'name': name, 'servers': {'': {'ready': polls <= len(requests) // 4}}}
+            for name, polls in polls_until_ready.items()
+        ]
+        items = users[offset : offset + limit]
+        next_page = None
+        if offset + limit < len(users):
+            next_page = {'offset': offset + limit, 'limit': limit}
+        return web.json_response({'items': items, '_pagination': {'next': next_page}})
+
+    app = web.Application()
+    app.router.add_get('/hub/api/users', list_users)
+    async with TestServer(app) as server:
+        hub_url = str(server.make_url('/'))
+        async with ServerStatusPoller(
+            hub_url, 'token', interval=0.01, page_size=3
+        ) as poller:
+            await asyncio.wait_for(
+                asyncio.gather(
+                    *[poller.wait_until_ready(name) for name in polls_until_ready]
+                ),
+                5,
+            )
+    # 4 pages per poll, no matter how many users were waiting
+    assert len(requests) % 4 == 0
+    assert len(requests) <= 4 * 4
+    assert not poller.waiters
+
+
+async def test_ensure_server_api_times_out():
+    async def start_server(request):
+        return web.Response(status=202)
+
+    async def list_users(request):
+        return web.json_response([{'name': 'slow', 'servers': {}}])
+
+    app = web.Application()
+    app.router.add_post('/hub/api/users/{name}/server', start_server)
+    app.router.add_get('/hub/api/users', list_users)
+    stats = Stats()
+    async with TestServer(app) as server:
+        hub_url = str(server.make_url('/'))
+        async with ServerStatusPoller(hub_url, 'token', interval=0.01) as poller:
+            async with User('slow', hub_url, no_auth, stats=stats) as u:
+                assert not await u.ensure_server_api('token', 0.2, poller=poller)
+    assert stats.failures['server-start'] == ['slow']
+    assert u.spawn_requested
+    assert not poller.waiters
@@ -0,0 +1,64 @@
+from functools import partial
+
+import structlog
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from yarl import URL
+
+from hubtraf.auth.store import login_from_store
+from hubtraf.provision import provision
+from hubtraf.user import User
+
+
+async def test_provision_cookies(tmp_path):
+    async def login_page(request):
+        response = web.Response(text='login')
+        response.set_cookie('_xsrf', 'xsrf', path='/hub/')
+        return response
+
+    async def login(request):
+        data = await request.post()
+        response = web.Response(status=302, headers={'Location': '/hub/home'})
+        response.set_cookie('hub', f'session-{data["username"]}', path='/hub/')
+        return response
+
+    app = web.Application()
+    app.router.add_get('/hub/login', login_page)
+    app.router.add_post('/hub/login', login)
+    async with TestServer(app, host='localhost') as server:
+        hub_url = URL(f'http://localhost:{server.port}')
+        results = await provision(hub_url, ['user-1', 'user-2'], str(tmp_path), 'pw')
+        assert results == {'user-1': 'provisioned', 'user-2': 'provisioned'}
+
+        async with User(
+            'user-2',
+            hub_url,
+            partial(login_from_store, store_dir=str(tmp_path)),
+        ) as u:
+            assert await u.login()
+            cookies = u.session.cookie_jar.filter_cookies(hub_url / 'hub/')
+            assert cookies['hub'].value == 'session-user-2'
+
+
+async def test_login_from_store_missing(tmp_path):
+    async with User('user-1', 'http://localhost', lambda **kwargs: None) as u:
+        assert not await login_from_store(
+            session=u.session,
+            hub_url=u.hub_url,
+            log=structlog.get_logger(),
+            username='user-1',
+            store_dir=str(tmp_path),
+        )
+
+
+async def test_login_from_store_token(tmp_path):
+    (tmp_path / 'user-1.token').write_text('secret\n')
+    async with User('user-1', 'http://localhost', lambda **kwargs: None) as u:
+        assert await login_from_store(
+            session=u.session,
+            hub_url=u.hub_url,
+            log=structlog.get_logger(),
+            username='user-1',
+            store_dir=str(tmp_path),
+        )
+        assert u.session.headers['Authorization'] == 'token secret'
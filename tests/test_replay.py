@@ -0,0 +1,76 @@
+import argparse
+import asyncio
+import json
+import signal
+
+import pytest
+
+from hubtraf import simulate
+from hubtraf.replay import replay_schedule
+
+
+def test_replay_schedule(tmp_path):
+    events = [
+        (0, 'alice', 'login', 'start'),
+        (10, 'bob', 'login', 'start'),
+        (20, 'carol', 'login', 'start'),
+        (30, 'bob', 'server-stop', 'complete'),
+        (100, 'alice', 'code-execute', 'complete'),
+        (5000, 'bob', 'login', 'start'),
+        (5060, 'bob', 'code-execute', 'complete'),
+    ]
+    logfile = tmp_path / 'events.log'
+    with open(logfile, 'w') as f:
+        for seconds, username, action, phase in events:
+            event = {
+                'timestamp': f'2018-03-09T{seconds // 3600:02}:{seconds // 60 % 60:02}:{seconds % 60:02}Z',
+                'username': username,
+                'action': action,
+                'phase': phase,
+            }
+            f.write(json.dumps(event) + '\n')
+        f.write('not json\n')
+
+    assert list(replay_schedule(logfile, time_compression=2, idle_timeout=3600)) == [
+        ('alice', 0, 50),
+        ('bob', 5, 10),
+        ('carol', 10, 0),
+        ('bob', 2500, 30),
+    ]
+
+
+def run_args(**kwargs):
+    args = argparse.Namespace(
+        hub_url='http://localhost:1',
+        user_count=10,
+        user_prefix='user',
+        execute_mode='think',
+        execute_rate=None,
+        workload=[],
+        credential_store=None,
+        auth='dummy',
+        replay=None,
+        time_compression=1,
+        monitor_interval=0,
+        trace_requests=False,
+        run_deadline=None,
+        teardown_concurrency=10,
+        teardown_retries=0,
+        teardown_deadline=10,
+    )
+    vars(args).update(kwargs)
+    return args
+
+
+async def test_run_raises_unreadable_replay(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        await simulate.run(run_args(replay=tmp_path / 'missing.log'))
+
+
+async def test_run_removes_signal_handlers(tmp_path):
+    args = run_args(replay=tmp_path / 'missing.log')
+    with pytest.raises(FileNotFoundError):
+        await simulate.run(args)
+    # SIGINT is back to raising KeyboardInterrupt, instead of setting an
+    # Event no one waits on anymore
+    assert not asyncio.get_running_loop().remove_signal_handler(signal.SIGINT)
@@ -0,0 +1,86 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from hubtraf.check import no_auth
+from hubtraf.shutdown import ShutdownManager
+from hubtraf.stats import Stats
+from hubtraf.user import User
+
+
+async def test_teardown_user_retries(fake_user):
+    shutdown = ShutdownManager(retries=1)
+    flaky = fake_user('flaky', User.States.KERNEL_STARTED, failures=1)
+    broken = fake_user('broken', User.States.SERVER_STARTED, failures=10)
+    for u in (flaky, broken):
+        shutdown.register(u)
+
+    assert await shutdown.teardown_user(flaky)
+    assert not await shutdown.teardown_user(broken)
+    assert shutdown.torn_down == 1
+    assert shutdown.leftovers() == ['broken']
+
+
+async def test_shutdown_cancels_and_tears_down(fake_user):
+    shutdown = ShutdownManager(concurrency=2)
+
+    async def simulate(u):
+        shutdown.register(u)
+        try:
+            await asyncio.sleep(60)
+        finally:
+            await shutdown.teardown_user(u)
+
+    users = [fake_user(f'user-{i}', User.States.KERNEL_STARTED) for i in range(10)]
+    tasks = [asyncio.ensure_future(simulate(u)) for u in users]
+    await asyncio.sleep(0)
+    leftovers = await shutdown.shutdown(tasks, deadline=5)
+
+    assert leftovers == []
+    assert shutdown.torn_down == 10
+    assert all(u.state == User.States.LOGGED_IN for u in users)
+
+
+async def test_teardown_user_with_pending_spawn(fake_user):
+    shutdown = ShutdownManager()
+    # Cancelled while waiting for its server to start
+    starting = fake_user('starting', User.States.LOGGED_IN, spawn_requested=True)
+    idle = fake_user('idle', User.States.LOGGED_IN)
+    for u in (starting, idle):
+        shutdown.register(u)
+    assert shutdown.leftovers() == ['starting']
+
+    assert await shutdown.teardown_user(starting)
+    assert await shutdown.teardown_user(idle)
+    assert not starting.spawn_requested
+    assert shutdown.torn_down == 1
+    assert shutdown.leftovers() == []
+
+
+async def test_teardown_user_kernel_stop_fails():
+    requests = []
+
+    async def stop_kernel(request):
+        requests.append('kernel')
+        return web.Response(status=500)
+
+    async def stop_server(request):
+        requests.append('server')
+        return web.Response(status=204)
+
+    app = web.Application()
+    app.router.add_delete('/user/{name}/api/kernels/{kernel_id}', stop_kernel)
+    app.router.add_delete('/hub/api/users/{name}/server', stop_server)
+    stats = Stats()
+    async with TestServer(app) as server:
+        async with User('user', str(server.make_url('/')), no_auth, stats=stats) as u:
+            u.state = User.States.KERNEL_STARTED
+            u.spawn_requested = True
+            u.kernel_id = 'kernel'
+            assert await ShutdownManager(retries=3).teardown_user(u)
+
+    # The server stop takes the kernel with it, so nothing is retried
+    assert requests == ['kernel', 'server']
+    assert u.state == User.States.LOGGED_IN
+    assert stats.failures['kernel-stop'] == ['user']
@@ -0,0 +1,29 @@
+from hubtraf.stats import Histogram, percentile, summarize
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([1, 2, 3, 4, 5], 0) == 1
+    assert percentile([1, 2, 3, 4, 5], 50) == 3
+    assert percentile([1, 2, 3, 4, 5], 100) == 5
+
+
+def test_summarize():
+    assert summarize([]) == {'count': 0}
+    summary = summarize([3, 1, 2])
+    assert summary['count'] == 3
+    assert summary['max'] == 3
+    assert summary['p50'] == 2
+
+
+def test_histogram():
+    histogram = Histogram()
+    assert histogram.summary() == {'count': 0}
+    for i in range(1, 1001):
+        histogram.add(i / 1000)
+    assert histogram.count == 1000
+    assert histogram.max == 1
+    # Percentiles are accurate to within one bucket
+    assert 0.5 <= histogram.percentile(50) <= 0.5 * 2 ** (1 / 8)
+    assert 0.95 <= histogram.percentile(95) <= 0.95 * 2 ** (1 / 8)
+    assert histogram.percentile(100) == 1
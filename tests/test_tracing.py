@@ -0,0 +1,41 @@
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from hubtraf.tracing import RequestTracer
+from hubtraf.user import User
+
+
+async def no_auth(**kwargs):
+    return True
+
+
+async def test_request_tracer():
+    async def hello(request):
+        return web.Response(text='hello')
+
+    app = web.Application()
+    app.router.add_get('/hello', hello)
+    tracer = RequestTracer()
+    async with TestServer(app, host='localhost') as server:
+        async with User('user-1', server.make_url('/'), no_auth, tracer=tracer) as u:
+            u.action = 'greet'
+            for _ in range(3):
+                async with u.session.get(server.make_url('/hello')) as resp:
+                    assert resp.status == 200
+
+    summary = tracer.summary()
+    assert summary['greet']['headers']['count'] == 3
+    assert summary['greet']['ttfb']['count'] == 3
+    # Connections are reused after the first request
+    assert summary['greet']['connect']['count'] == 1
+
+
+def test_record_execute():
+    tracer = RequestTracer()
+    tracer.record_execute(
+        {'sent': 0, 'busy': 0.1, 'execute_input': 0.2, 'output': 0.5, 'idle': 0.6}
+    )
+    summary = tracer.summary()['code-execute']
+    assert summary['sent-busy']['count'] == 1
+    assert 0.3 <= summary['input-output']['p50'] <= 0.3 * 2 ** (1 / 8)
+    assert 'sent-reply' not in summary
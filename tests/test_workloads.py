@@ -0,0 +1,46 @@
+import ast
+import random
+
+import pytest
+
+from hubtraf.workloads import CELLS, choose_cell, parse_workload
+
+
+def run_cell(code):
+    """
+    Run code like a kernel would, returning the repr of its last expression
+    """
+    tree = ast.parse(code)
+    last = ast.Expression(tree.body.pop().value)
+    namespace = {}
+    exec(compile(tree, '<cell>', 'exec'), namespace)
+    return repr(eval(compile(last, '<cell>', 'eval'), namespace))
+
+
+@pytest.mark.parametrize('kind,amount', [('cpu', 0.05), ('memory', 3.5), ('disk', 2)])
+def test_cell_output(tmp_path, monkeypatch, kind, amount):
+    monkeypatch.chdir(tmp_path)
+    code, output = CELLS[kind](amount, 'user-1')
+    assert run_cell(code) == output
+    # Outputs differ between users, so one user's can't pass for another's
+    assert CELLS[kind](amount, 'user-2')[1] != output
+
+
+def test_disk_cell_writes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    run_cell(CELLS['disk'](3, 'user-1')[0])
+    assert (tmp_path / '.hubtraf-disk').stat().st_size == 3 * 1024 * 1024
+
+
+def test_choose_cell():
+    workloads = [parse_workload('cpu=1:3'), parse_workload('memory=64')]
+    rng = random.Random(0)
+    chosen = [choose_cell(workloads, 'user', rng) for _ in range(1000)]
+    cpu = chosen.count(CELLS['cpu'](1.0, 'user'))
+    assert 700 < cpu < 800
+    assert cpu + chosen.count(CELLS['memory'](64.0, 'user')) == 1000
+
+    for spec in ['gpu=1', 'cpu=-1', 'memory=64:0', 'disk=10:-1']:
+        with pytest.raises(ValueError):
+            parse_workload(spec)
+    assert parse_workload('cpu=0') == ('cpu', 0.0, 1.0)